@@ -0,0 +1,210 @@
+#################################################################
+#
+#   Usage:      Benchmark [out_file=filename] [compare=filename] -options
+#
+#   This File:  Measures how long each search engine takes to build
+#               its tree and to scan a DNA sequence, using generated
+#               enzyme sets for each level of complexity in the README
+#               and a generated genome, and saves the results as JSON
+#
+#################################################################
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+import SearchEngines
+import NumpyScan
+import ResultManager
+
+# resource isn't available on Windows, peak memory is left out of the results there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Each tier is a recognition sequence template and the number of enzymes generated from it. The ambiguity codes are
+# kept and only the plain bases are replaced with random ones, so each tier has the complexity of its README example
+TIERS = {
+    "six_cutter": ("NNNNNN", 100),
+    "NNCASTGNN": ("NNCASTGNN", 10),
+    "CGANNNNNNTGC": ("CGANNNNNNTGC", 4),
+    "CCANNNNNNNNNTGG": ("CCANNNNNNNNNTGG", 1),
+}
+BASES = "ACGT"
+
+# used to hold the benchmark settings, changed with key=value arguments and -options on the command line
+settings = {"out_file" : "bench_results.json", "compare" : "", "genome_length" : 1000000, "seed" : 2021,
+            "engines" : ["trie", "automaton", "mask", "compact", "numpy"], "tiers" : list(TIERS), "max_mismatches" : 0}
+
+
+def create_engine(engine_name, max_mismatches=0):
+    # automaton is the trie with Aho-Corasick links, the rest are the engines that can be chosen in Regulon.py
+    if engine_name == "automaton":
+        # The automaton only finds exact matches
+        if max_mismatches:
+            return None
+        return SearchEngines.create_engine("trie", use_automaton=True)
+    if engine_name == "numpy" and NumpyScan.numpy is None:
+        return None
+    return SearchEngines.create_engine(engine_name, max_mismatches=max_mismatches)
+
+
+def generate_genome(length, seed):
+    rng = random.Random(seed)
+    return ''.join(rng.choice(BASES) for _ in range(length))
+
+
+def generate_enzymes(tier, seed):
+    """Returns a dictionary of enzyme name to recognition sequence for the tier. For the six cutters every position is
+    a random base, otherwise the ambiguity codes of the template stay where they are and each A, C, G or T is
+    replaced with a random base"""
+    template, count = TIERS[tier]
+    rng = random.Random(f"{seed}-{tier}")
+    enzymes = {}
+    for number in range(count):
+        if tier == "six_cutter":
+            seq = ''.join(rng.choice(BASES) for _ in template)
+        else:
+            seq = ''.join(rng.choice(BASES) if code in BASES else code for code in template)
+        enzymes[f"{tier}_{number}"] = seq
+    return enzymes
+
+
+def write_enzyme_file(filename, enzymes):
+    with open(filename, "w") as re_file:
+        re_file.write("Sequence,Name\n")
+        for name, seq in enzymes.items():
+            re_file.write(f"{seq},{name}\n")
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(engine_name, re_filename, dna_sequence, max_mismatches=0):
+    """Runs in its own process so the peak memory belongs to this engine and tier only"""
+    engine = create_engine(engine_name, max_mismatches)
+    result_manager = ResultManager.Result_Manager(re_filename, "benchmark")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        engine.build_tree(re_filename)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine.scan_sequence(dna_sequence, result_manager)
+        scan_seconds = time.perf_counter() - start
+    usage = engine.memory_usage()
+    return {"build_seconds": round(build_seconds, 4),
+            "scan_seconds": round(scan_seconds, 4),
+            "scan_bases_per_second": round(len(dna_sequence) / scan_seconds) if scan_seconds > 0 else None,
+            "nodes": usage["nodes"],
+            "engine_bytes": usage["bytes"],
+            "peak_rss_kb": peak_rss_kb(),
+            "matches": result_manager.get_match_count()}
+
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks():
+    dna_sequence = generate_genome(settings["genome_length"], settings["seed"])
+    results = {"revision": get_revision(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "genome_length": settings["genome_length"],
+               "seed": settings["seed"],
+               "max_mismatches": settings["max_mismatches"],
+               "cases": []}
+    with tempfile.TemporaryDirectory(prefix="regulon_bench_") as work_dir:
+        for tier in settings["tiers"]:
+            re_filename = os.path.join(work_dir, f"{tier}.txt")
+            write_enzyme_file(re_filename, generate_enzymes(tier, settings["seed"]))
+            for engine_name in settings["engines"]:
+                if create_engine(engine_name, settings["max_mismatches"]) is None:
+                    print(f"Skipping engine {engine_name}, it isn't available")
+                    continue
+                # A new process for every case so the memory of one doesn't count towards the next
+                with multiprocessing.Pool(1) as pool:
+                    case = pool.apply(run_case, (engine_name, re_filename, dna_sequence, settings["max_mismatches"]))
+                case = {"tier": tier, "engine": engine_name, **case}
+                results["cases"].append(case)
+                print(f"{tier:16} {engine_name:10} build {case['build_seconds']:8.3f}s  "
+                      f"scan {case['scan_bases_per_second'] or 0:>10} bases/s  nodes {case['nodes']:>8}  "
+                      f"peak {case['peak_rss_kb']} kB  matches {case['matches']}")
+    return results
+
+
+def compare_results(results, old_filename):
+    """Prints how each case has changed compared to an earlier results file"""
+    try:
+        with open(old_filename, "r") as old_file:
+            old_results = json.load(old_file)
+    except Exception as err:
+        print(f"\nERROR - Benchmark.compare_results() had a problem with the file: {old_filename}.\nError was: ", err)
+        return
+    old_cases = {(case["tier"], case["engine"]): case for case in old_results["cases"]}
+    print(f"\nCompared to revision {old_results.get('revision') or old_filename}:")
+    for case in results["cases"]:
+        old_case = old_cases.get((case["tier"], case["engine"]))
+        if not old_case:
+            continue
+        build_ratio = case["build_seconds"] / old_case["build_seconds"] if old_case["build_seconds"] else 0
+        scan_ratio = ((case["scan_bases_per_second"] or 0) / old_case["scan_bases_per_second"]
+                      if old_case["scan_bases_per_second"] else 0)
+        print(f"{case['tier']:16} {case['engine']:10} build time x{build_ratio:.2f}  scan speed x{scan_ratio:.2f}")
+
+
+def parse_command_line():
+    for arg in sys.argv[1:]:
+        if arg.startswith("-"):
+            name, _, value = arg[1:].partition("=")
+            if name == "quick":
+                settings["genome_length"] = 100000
+            elif name == "genome" and value.isdigit():
+                settings["genome_length"] = int(value)
+            elif name == "seed" and value.isdigit():
+                settings["seed"] = int(value)
+            elif name == "mismatches" and value.isdigit():
+                settings["max_mismatches"] = int(value)
+            elif name == "engines" and value:
+                settings["engines"] = value.split(",")
+            elif name == "tiers" and value:
+                settings["tiers"] = [tier for tier in value.split(",") if tier in TIERS]
+            else:
+                print(f"Unrecognised option: {arg}")
+                print("\ncommand line usage:  Benchmark [out_file=filename] [compare=filename] -options\n")
+                print("and the options can be any of -quick (100,000 base genome), -genome=N, -seed=N, -mismatches=N,")
+                print(f"-engines=name,name (from {', '.join(settings['engines'])}) and -tiers=name,name "
+                      f"(from {', '.join(TIERS)})\n")
+                return False
+        elif arg.startswith("out_file="):
+            settings["out_file"] = arg.split("=", 1)[1]
+        elif arg.startswith("compare="):
+            settings["compare"] = arg.split("=", 1)[1]
+    return True
+
+
+if __name__ == "__main__":
+    if parse_command_line():
+        benchmark_results = run_benchmarks()
+        with open(settings["out_file"], "w") as results_file:
+            json.dump(benchmark_results, results_file, indent=4)
+        print(f"\nResults saved to {settings['out_file']}")
+        if settings["compare"]:
+            compare_results(benchmark_results, settings["compare"])
@@ -0,0 +1,308 @@
+#############################################################################
+#
+#   Usage:      Used by main script Regulon.py with -engine=compact
+#
+#   This File:  Same tree as SeqTree.py but stored in flat arrays rather
+#               than one Python object per node, so the combinatorial
+#               expansion of the ambiguity codes takes far less memory
+#
+#############################################################################
+
+# Import standard modules
+import pprint
+from array import array
+# import utility module to handle reading the source files
+import FileHandler
+import Nucleotides
+import SeqScanner
+import RunStats
+
+# Position of each nucleotide within the 4 child slots of a node
+BASE_INDEX = {base: index for index, base in enumerate(Nucleotides.BASES)}
+# Value stored in a child slot when there is no child
+NO_CHILD = -1
+
+
+class RECompactTree:
+    """Restriction enzyme (RE) sequence tree where node n is just a number. Its children for A, C, G and T are
+    found at children[n * 4] to children[n * 4 + 3] and the (name, strand) entries of the REs ending at the node are
+    found at re_values[re_offsets[n]:re_offsets[n + 1]] as indexes into the list of names. Unlike the RESeqTree's walk,
+    which stops at the first branch end, the walk carries on to the longer sequences below, so every enzyme matching
+    at a position is reported, the same as the RESeqTree with -automaton"""
+
+    # Part of the name of the cache files, change it whenever the layout of the arrays or the metadata changes
+    TREE_VERSION = 2
+
+    def __init__(self, cache=None, both_strands=False, max_mismatches=0):
+        self.clear_tree()
+        self.re_filename = ""
+        self.re_file_MD5_checksum = ""
+
+        # Compiled trees are saved to and loaded from this TreeCache.Tree_Cache, unless it is None
+        self.cache = cache
+
+        # When set the reverse complement of each enzyme is inserted as well so one scan finds both strands
+        self.both_strands = both_strands
+        # When more than 0 the search also reports near-sites that differ from a sequence in up to this many positions
+        self.max_mismatches = max_mismatches
+
+    def clear_tree(self):
+        """Empties the tree so it can be built again from a changed enzyme file"""
+        # Node 0 is the root
+        self.children = array('i', [NO_CHILD] * 4)
+        self.node_count = 1
+        self.tree_width = 0
+        self.tree_depth = 0
+
+        # The (name, strand) entries are only stored once, the tree holds their index in this list
+        self.names = []
+        self.name_ids = {}
+        # Enzyme ids for each node in offsets/values form, filled in by finalise_tree() once all sequences are in
+        self.re_offsets = array('i', [0, 0])
+        self.re_values = array('i')
+        # While the tree is being built the enzyme ids are collected per branch end node
+        self.branch_end_ids = {}
+
+        self.re_seq_dict = {}
+        self.sequence_count = 0
+        self.unique_sequence_count = 0
+
+        # When a tree is loaded from the cache the arrays are views of the memory mapped cache file which is kept
+        # open here. The views above have replaced the old ones, so the file is closed when it is garbage collected
+        self.cache_map = None
+
+    def get_tree_width(self):
+        return self.tree_width
+
+    def get_tree_depth(self):
+        return self.tree_depth
+
+    def get_sequence_count(self):
+        return self.sequence_count
+
+    def get_node_count(self):
+        return self.node_count
+
+    def build_tree(self, filename):
+        checksum = FileHandler.file_checksum(filename)
+        if filename == self.re_filename and checksum == self.re_file_MD5_checksum:
+            return
+
+        self.clear_tree()
+        self.re_filename = filename
+        self.re_file_MD5_checksum = checksum
+        # A tree with the reverse complements in it is cached separately from the one without
+        cache_key = f"{checksum}-both" if checksum and self.both_strands else checksum
+        with RunStats.stats.timer("load_cache"):
+            loaded = self.cache and self.cache.load_tree(self, cache_key)
+        if loaded:
+            print(f"Loaded compact tree for {filename} with {self.node_count} nodes from cache")
+            return
+
+        with RunStats.stats.timer("parse_enzymes"):
+            self.re_seq_dict, self.tree_depth = FileHandler.import_restriction_enzymes(filename)
+        start_node_count = self.node_count
+        sequences = Nucleotides.strand_sequences(self.re_seq_dict, self.both_strands)
+        progress = RunStats.Progress(f"Processing Restriction Enzymes sequences from {filename}", len(sequences))
+        with RunStats.stats.timer("insert_sequences"):
+            for current_seq_count, (entry, seq) in enumerate(sequences, 1):
+                self.insert_sequence(seq, entry)
+                progress.update(current_seq_count)
+            self.finalise_tree()
+        progress.finish()
+        RunStats.stats.add("nodes_created", self.node_count - start_node_count)
+        print(f"Built compact tree from {filename} with {self.node_count} nodes")
+        if self.cache:
+            self.cache.save_tree(self, cache_key)
+
+    def get_metadata(self):
+        """Everything apart from the arrays that is needed to rebuild the tree from the cache"""
+        return {"names": self.names, "re_seq_dict": self.re_seq_dict, "tree_depth": self.tree_depth,
+                "tree_width": self.tree_width, "sequence_count": self.sequence_count,
+                "unique_sequence_count": self.unique_sequence_count}
+
+    def load_arrays(self, children, re_offsets, re_values, metadata, cache_map=None):
+        """Replaces the tree with the arrays and metadata loaded by the cache"""
+        self.children = children
+        self.re_offsets = re_offsets
+        self.re_values = re_values
+        self.node_count = len(children) // 4
+        # JSON turns the entries into lists
+        self.names = [tuple(entry) for entry in metadata["names"]]
+        self.name_ids = {name: name_id for name_id, name in enumerate(self.names)}
+        self.re_seq_dict = metadata["re_seq_dict"]
+        self.tree_depth = metadata["tree_depth"]
+        self.tree_width = metadata["tree_width"]
+        self.sequence_count = metadata["sequence_count"]
+        self.unique_sequence_count = metadata["unique_sequence_count"]
+        self.branch_end_ids = {}
+        self.cache_map = cache_map
+
+    def __getstate__(self):
+        # Views of a memory mapped file can't be pickled, which is needed to send the tree to a spawned process,
+        # so send copies of the arrays instead
+        state = self.__dict__.copy()
+        if self.cache_map is not None:
+            for key in ("children", "re_offsets", "re_values"):
+                state[key] = array('i', state[key])
+            state["cache_map"] = None
+        return state
+
+    def intern_name(self, entry):
+        name_id = self.name_ids.get(entry)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(entry)
+            self.name_ids[entry] = name_id
+        return name_id
+
+    def add_node(self):
+        self.children.extend((NO_CHILD, NO_CHILD, NO_CHILD, NO_CHILD))
+        self.node_count += 1
+        return self.node_count - 1
+
+    def insert_sequence(self, sequence, entry):
+        """Adds every combination of the ambiguity codes in the sequence to the tree. Rather than recursing once per
+        combination the set of nodes reached so far is extended one position at a time"""
+        self.sequence_count += 1
+        children = self.children
+        frontier = [0]
+        for code in sequence:
+            bases = Nucleotides.IUPAC_CODES.get(code)
+            if bases is None:
+                print("Nucleotide", code, "not supported in CompactSeqTree.insert_sequence()")
+                return
+            next_frontier = []
+            for node in frontier:
+                for base in bases:
+                    slot = node * 4 + BASE_INDEX[base]
+                    child = children[slot]
+                    if child == NO_CHILD:
+                        child = self.add_node()
+                        children[slot] = child
+                    next_frontier.append(child)
+            frontier = next_frontier
+
+        name_id = self.intern_name(entry)
+        for node in frontier:
+            ids = self.branch_end_ids.get(node)
+            if ids is None:
+                ids = self.branch_end_ids[node] = []
+                self.unique_sequence_count += 1
+            ids.append(name_id)
+            self.tree_width += 1
+
+    def finalise_tree(self):
+        """Packs the enzyme ids collected while building into the re_offsets and re_values arrays"""
+        self.re_offsets = array('i', [0]) * (self.node_count + 1)
+        self.re_values = array('i')
+        for node in range(self.node_count):
+            ids = self.branch_end_ids.get(node)
+            if ids:
+                self.re_values.extend(ids)
+            self.re_offsets[node + 1] = len(self.re_values)
+        self.branch_end_ids = {}
+
+    def is_branch_end(self, node):
+        return self.re_offsets[node] != self.re_offsets[node + 1]
+
+    def get_names(self, node):
+        return [self.names[name_id] for name_id in self.re_values[self.re_offsets[node]:self.re_offsets[node + 1]]]
+
+    def scan_sequence(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Searches one chunk of a DNA sequence. The offset is the position of the chunk in its FASTA record and
+        the first overlap nucleotides were already searched as the end of the previous chunk"""
+        if self.max_mismatches:
+            self.scan_mismatches(dna_sequence, result_manager, record, offset, overlap)
+            return
+        children = self.children
+        re_offsets = self.re_offsets
+        dna_seq_length = len(dna_sequence)
+        nodes_visited = 0
+        for pos in range(dna_seq_length):
+            search_window_end = min(pos + self.tree_depth, dna_seq_length)
+            node = 0
+            for index in range(pos, search_window_end):
+                base_index = BASE_INDEX.get(dna_sequence[index])
+                if base_index is None:
+                    break
+                node = children[node * 4 + base_index]
+                if node == NO_CHILD:
+                    break
+                nodes_visited += 1
+                # Anything ending inside the overlap was reported with the previous chunk
+                if re_offsets[node] != re_offsets[node + 1] and index >= overlap:
+                    # need to add 1 to position because loop starts from 0
+                    Nucleotides.report_strands(result_manager, offset + pos + 1, self.get_names(node), record)
+        RunStats.stats.add("nodes_visited", nodes_visited)
+
+    def scan_mismatches(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Same as RESeqTree.scan_mismatches(), follows every child of a node while the number of bases that differ
+        is within max_mismatches and reports the fewest mismatches found for each entry at each position"""
+        children = self.children
+        re_offsets = self.re_offsets
+        max_mismatches = self.max_mismatches
+        dna_seq_length = len(dna_sequence)
+        nodes_visited = 0
+        for pos in range(dna_seq_length):
+            search_window_end = min(pos + self.tree_depth, dna_seq_length)
+            found = {}
+            stack = [(0, pos, 0)]
+            while stack:
+                node, index, mismatches = stack.pop()
+                base_index = BASE_INDEX.get(dna_sequence[index])
+                if base_index is None:
+                    continue
+                for child_index in range(4):
+                    child = children[node * 4 + child_index]
+                    if child == NO_CHILD:
+                        continue
+                    child_mismatches = mismatches if child_index == base_index else mismatches + 1
+                    if child_mismatches > max_mismatches:
+                        continue
+                    nodes_visited += 1
+                    # Anything ending inside the overlap was reported with the previous chunk
+                    if re_offsets[child] != re_offsets[child + 1] and index >= overlap:
+                        for entry in self.get_names(child):
+                            if found.get(entry, max_mismatches + 1) > child_mismatches:
+                                found[entry] = child_mismatches
+                    if index + 1 < search_window_end:
+                        stack.append((child, index + 1, child_mismatches))
+            if found:
+                entries_by_mismatches = {}
+                for entry, mismatches in found.items():
+                    entries_by_mismatches.setdefault(mismatches, []).append(entry)
+                for mismatches, entries in sorted(entries_by_mismatches.items()):
+                    # need to add 1 to position because loop starts from 0
+                    Nucleotides.report_strands(result_manager, offset + pos + 1, entries, record, mismatches)
+        RunStats.stats.add("nodes_visited", nodes_visited)
+
+    def find_matches(self, filename, result_manager, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, region=None):
+        SeqScanner.scan_file(self, filename, result_manager, chunk_size, region=region)
+
+    def memory_usage(self):
+        """Returns the number of nodes and the bytes used by the arrays holding the tree"""
+        array_bytes = sum(len(values) * values.itemsize for values in (self.children, self.re_offsets, self.re_values))
+        name_bytes = sum(len(name) for name, strand in self.names)
+        return {"nodes": self.node_count, "bytes": array_bytes + name_bytes}
+
+    def print_memory_usage(self):
+        usage = self.memory_usage()
+        print(f"Compact tree has {usage['nodes']} nodes using {usage['bytes']} bytes")
+
+    def print_tree(self):
+        tree_sequences = []
+        # Depth first walk using a stack of (node, sequence so far), pushed in reverse so A comes out first
+        stack = [(0, "")]
+        while stack:
+            node, branch_sequence = stack.pop()
+            if self.is_branch_end(node):
+                tree_sequences.append(branch_sequence + " -> "
+                                      + ', '.join(Nucleotides.strand_label(entry) for entry in self.get_names(node)))
+            for base in reversed(Nucleotides.BASES):
+                child = self.children[node * 4 + BASE_INDEX[base]]
+                if child != NO_CHILD:
+                    stack.append((child, branch_sequence + base))
+        print(f"\nThis tree has {self.unique_sequence_count} unique restriction enzyme sequences")
+        pp = pprint.PrettyPrinter(indent=4)
+        pp.pprint(tree_sequences)
@@ -11,6 +11,28 @@
 #
 #############################################################################
 
+import re
+import hashlib
+import RunStats
+
+# Cut positions written after (or before) a recognition sequence, e.g. GACGC(5/10) cuts the top strand 5 bases after
+# the site and the bottom strand 10 bases after it
+CUT_ANNOTATION = re.compile(r"\((-?\d+)/(-?\d+)\)")
+
+
+def file_checksum(filename):
+    """Returns the MD5 checksum of the file contents as a hex string, or an empty string if it can't be read"""
+    md5 = hashlib.md5()
+    try:
+        with open(filename, "rb") as check_file:
+            for block in iter(lambda: check_file.read(65536), b""):
+                md5.update(block)
+    except Exception as err:
+        print(f"\nERROR - FileHandler.file_checksum() had a problem with the file: {filename}.\nError was: ", err)
+        return ""
+    return md5.hexdigest()
+
+
 def import_restriction_enzymes(filename):
     """Reads the file with restriction enzyme recognition sequences and names, parses them and adds them to a
     dictionary. Returns the dictionary and the length of the longest sequence"""
@@ -37,14 +59,54 @@ def import_restriction_enzymes(filename):
         RE_file.close()
     except Exception as err:
         print(f"\nERROR - FileHandler.import_restriction_enzymes() had a problem with the file: {filename}.\nError was: ", err)
+    RunStats.stats.add("enzymes_read", len(sequence_dict))
     return sequence_dict, tree_depth
 
 
+def parse_cut_site(re_seq):
+    """Works out where an enzyme cuts from the annotations in its recognition sequence, which are stripped out by
+    import_restriction_enzymes(). Returns (top, bottom), the number of bases from the start of the site to the cut
+    on each strand counted along the top strand. G/AATTC gives (1, 5) and GACGC(5/10) gives (10, 15). A site with no annotation
+    is taken to be cut in the middle"""
+    seq = ''.join(filter(str.isalpha, re_seq))
+    annotation = CUT_ANNOTATION.search(re_seq)
+    if annotation:
+        top_offset, bottom_offset = int(annotation.group(1)), int(annotation.group(2))
+        if not any(character.isalpha() for character in re_seq[:annotation.start()]):
+            # Written before the site, so the cuts are that many bases upstream of it
+            return -top_offset, -bottom_offset
+        return len(seq) + top_offset, len(seq) + bottom_offset
+    if "/" in re_seq:
+        top = len(''.join(filter(str.isalpha, re_seq[:re_seq.index("/")])))
+        return top, len(seq) - top
+    return len(seq) // 2, len(seq) - len(seq) // 2
+
+
+def import_cut_sites(filename):
+    """Reads the restriction enzyme definition file again and returns a dictionary of enzyme name to the cut
+    positions found by parse_cut_site()"""
+    cut_sites = {}
+    try:
+        with open(filename, "r") as RE_file:
+            next(RE_file, None)     # skip the header line
+            for line in RE_file:
+                fields = line.rstrip("\n").split(",")
+                if len(fields) > 1:
+                    cut_sites[fields[1]] = parse_cut_site(fields[0])
+    except Exception as err:
+        print(f"\nERROR - FileHandler.import_cut_sites() had a problem with the file: {filename}.\nError was: ", err)
+    return cut_sites
+
+
+# Number of nucleotides read from a sequence file at a time by stream_seq_file()
+DEFAULT_CHUNK_SIZE = 1000000
+
+
 def import_seq_file(filename):
     """Reads the file with the DNA sequence. Assumes a standard FASTA file format which is info on the first line
     marked with a greater than symbol and then the DNA sequence is all the following lines concatenated together.
     This function returns the DNA sequence as a string."""
-    dna_sequence = ""
+    lines = []
 
     try:
         with open(filename, "r") as seq_file:
@@ -53,9 +115,85 @@ def import_seq_file(filename):
                     continue
                 else:
                     line = line.replace('\n', '')  # remove the newline character
-                    dna_sequence += line
+                    lines.append(line)  # joined once at the end, adding to a string each time is very slow
         seq_file.close()
     except Exception as err:
         print(f"\nERROR - FileHandler.import_seq_file() had a problem with the file: {filename}.\nError was: ", err)
 
-    return dna_sequence
+    return ''.join(lines)
+
+
+def stream_seq_file(filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reads the file with the DNA sequence a chunk at a time so the whole sequence never has to be held in memory.
+    Supports FASTA files with several records, each starting with a line marked with a greater than symbol.
+    This function is a generator returning (record name, position of the chunk in the record, chunk) where the
+    record name is the first word after the greater than symbol, or None if the file has no header line"""
+    try:
+        with open(filename, "r") as seq_file:
+            yield from stream_seq_lines(seq_file, chunk_size)
+        seq_file.close()
+    except Exception as err:
+        print(f"\nERROR - FileHandler.stream_seq_file() had a problem with the file: {filename}.\nError was: ", err)
+
+
+def stream_seq_lines(seq_lines, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Same as stream_seq_file() but works through lines of FASTA text that have already been read, for example by
+    the batch mode which reads the next files while the current one is being searched"""
+    record_name = None
+    record_offset = 0
+    lines = []
+    buffered = 0
+    # Only added to the run statistics once per chunk to keep the cost down
+    bytes_read = 0
+
+    for line in seq_lines:
+        bytes_read += len(line)
+        if line.startswith(">"):
+            RunStats.stats.add("records_read")
+            # Flush whatever is left of the previous record before starting the new one
+            RunStats.stats.add("bytes_read", bytes_read)
+            bytes_read = 0
+            if buffered:
+                yield record_name, record_offset, ''.join(lines)
+            header = line[1:].split()
+            record_name = header[0] if header else ""
+            record_offset = 0
+            lines = []
+            buffered = 0
+            continue
+        line = line.rstrip()  # remove the newline character
+        lines.append(line)
+        buffered += len(line)
+        if buffered >= chunk_size:
+            RunStats.stats.add("bytes_read", bytes_read)
+            bytes_read = 0
+            buffer = ''.join(lines)
+            while len(buffer) >= chunk_size:
+                yield record_name, record_offset, buffer[:chunk_size]
+                record_offset += chunk_size
+                buffer = buffer[chunk_size:]
+            lines = [buffer]
+            buffered = len(buffer)
+    RunStats.stats.add("bytes_read", bytes_read)
+    if buffered:
+        yield record_name, record_offset, ''.join(lines)
+
+
+def stream_seq_windows(filename, overlap, chunk_size=DEFAULT_CHUNK_SIZE, seq_lines=None):
+    """Wraps stream_seq_file() so each chunk starts with the last overlap nucleotides of the previous chunk from the
+    same record, which means a reference sequence that crosses the join between 2 chunks is not missed. Returns
+    (record name, position of the window in the record, window, number of overlap nucleotides at the start).
+    If seq_lines is given the FASTA text is taken from it rather than read from the file"""
+    if seq_lines is not None:
+        chunks = stream_seq_lines(seq_lines, chunk_size)
+    else:
+        chunks = stream_seq_file(filename, chunk_size)
+    previous_record = None
+    tail = ""
+    for record_name, record_offset, chunk in chunks:
+        if record_name != previous_record or record_offset == 0:
+            tail = ""
+        previous_record = record_name
+        window = tail + chunk
+        yield record_name, record_offset - len(tail), window, len(tail)
+        tail = window[-overlap:] if overlap > 0 else ""
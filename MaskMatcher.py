@@ -0,0 +1,184 @@
+#############################################################################
+#
+#   Usage:      Used by main script Regulon.py with -engine=mask
+#
+#   This File:  Searches for the reference sequences from re_file=filename
+#               without expanding the ambiguity codes. Each enzyme is
+#               compiled to a list of 4-bit nucleotide masks and all of
+#               them are matched at once with a bit-parallel Shift-And
+#
+#############################################################################
+
+# Import standard modules
+import sys
+# import utility module to handle reading the source files
+import FileHandler
+import Nucleotides
+import SeqScanner
+import RunStats
+
+
+class REMaskMatcher:
+    """Alternative to the RESeqTree which keeps every restriction enzyme (RE) sequence as a list of per position
+    nucleotide masks. Memory use is linear in the total length of the sequences rather than in the number of
+    combinations the ambiguity codes expand into"""
+
+    def __init__(self, both_strands=False, max_mismatches=0):
+        self.tree_depth = 0
+
+        # Following matches the RESeqTree so both can be used by Regulon.py
+        self.re_seq_dict = {}
+        self.sequence_count = 0
+        self.unique_sequence_count = 0
+        self.re_filename = ""
+
+        # Each unique sequence is stored once with the list of (RE name, strand) entries that share it and its 4-bit
+        # masks
+        self.patterns = []
+
+        # Shift-And state. All the patterns are laid end to end in one big integer so a single shift moves every
+        # pattern forward one position. For each base there is a mask of the pattern positions that accept it
+        self.base_masks = {base: 0 for base in Nucleotides.BASES}
+        self.start_mask = 0
+        self.end_mask = 0
+        # Maps the bit at the end of each pattern back to the index of the pattern in self.patterns
+        self.end_bits = {}
+
+        # When set the reverse complement of each enzyme is compiled as well so one scan finds both strands
+        self.both_strands = both_strands
+        # When more than 0 the search also reports near-sites that differ from a sequence in up to this many positions
+        self.max_mismatches = max_mismatches
+
+    def get_tree_depth(self):
+        return self.tree_depth
+
+    def get_sequence_count(self):
+        return self.sequence_count
+
+    def build_tree(self, filename):
+        """Named to match RESeqTree.build_tree(), compiles the sequences in the file into the Shift-And masks"""
+        if filename == self.re_filename:
+            return
+
+        self.re_filename = filename
+        with RunStats.stats.timer("parse_enzymes"):
+            self.re_seq_dict, self.tree_depth = FileHandler.import_restriction_enzymes(filename)
+
+        # Group the entries by sequence so enzymes with the same recognition sequence are reported together
+        entries_by_sequence = {}
+        for entry, seq in Nucleotides.strand_sequences(self.re_seq_dict, self.both_strands):
+            entries_by_sequence.setdefault(seq, []).append(entry)
+
+        self.patterns = []
+        for seq, entries in entries_by_sequence.items():
+            self.sequence_count += len(entries)
+            masks = Nucleotides.sequence_to_masks(seq)
+            if not masks:
+                print(f"Sequence {seq} for {[name for name, strand in entries]} not supported in "
+                      f"MaskMatcher.build_tree()")
+                continue
+            self.patterns.append((seq, entries, masks))
+        self.unique_sequence_count = len(self.patterns)
+        self.compile_masks()
+        print(f"Compiled {self.unique_sequence_count} restriction enzyme sequences from {filename}")
+
+    def compile_masks(self):
+        """Lays the patterns end to end and sets a bit in each base mask for every pattern position that accepts it"""
+        self.base_masks = {base: 0 for base in Nucleotides.BASES}
+        self.start_mask = 0
+        self.end_mask = 0
+        self.end_bits = {}
+        bit = 0
+        for index, (seq, entries, masks) in enumerate(self.patterns):
+            self.start_mask |= 1 << bit
+            for mask in masks:
+                for base in Nucleotides.BASES:
+                    if mask & Nucleotides.NUCLEOTIDE_BITS[base]:
+                        self.base_masks[base] |= 1 << bit
+                bit += 1
+            self.end_mask |= 1 << (bit - 1)
+            self.end_bits[bit - 1] = index
+
+    def scan_sequence(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Single pass Shift-And search. After reading each base a bit is set for every pattern position that
+        matches the bases read so far, so a set bit at the end of a pattern means the whole pattern matched.
+        The offset is the position of the chunk in its FASTA record and the first overlap nucleotides were already
+        searched as the end of the previous chunk"""
+        if self.max_mismatches:
+            self.scan_mismatches(dna_sequence, result_manager, record, offset, overlap)
+            return
+        base_masks = self.base_masks
+        start_mask = self.start_mask
+        end_mask = self.end_mask
+        state = 0
+        for pos, base in enumerate(dna_sequence):
+            # Bits shifted out of the end of one pattern land on the start of the next one, which is always set
+            # anyway, so the patterns can't interfere with each other. Anything that isn't A, C, G or T clears them all
+            state = ((state << 1) | start_mask) & base_masks.get(base, 0)
+            hits = state & end_mask
+            # Anything ending inside the overlap was reported with the previous chunk
+            if hits and pos >= overlap:
+                self.report_hits(hits, pos, result_manager, record, offset)
+
+    def scan_mismatches(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Shift-And extended to allow mismatches. There is a state for each number of mismatches from 0 up to
+        max_mismatches, and state j is advanced as normal or from state j - 1 whatever the base is, which uses up
+        one mismatch. So each base costs max_mismatches + 1 times the shifts and masks of the exact search.
+        Anything other than the 4 basic nucleotides clears every state so a near-site can't run across a gap"""
+        base_masks = self.base_masks
+        start_mask = self.start_mask
+        end_mask = self.end_mask
+        max_mismatches = self.max_mismatches
+        states = [0] * (max_mismatches + 1)
+        for pos, base in enumerate(dna_sequence):
+            base_mask = base_masks.get(base)
+            if base_mask is None:
+                states = [0] * (max_mismatches + 1)
+                continue
+            # Work down from the most mismatches so state j - 1 still holds its value for the previous base
+            for mismatches in range(max_mismatches, 0, -1):
+                states[mismatches] = ((((states[mismatches] << 1) | start_mask) & base_mask)
+                                      | (states[mismatches - 1] << 1) | start_mask)
+            states[0] = ((states[0] << 1) | start_mask) & base_mask
+            # Anything ending inside the overlap was reported with the previous chunk
+            if pos >= overlap and states[max_mismatches] & end_mask:
+                # A pattern is only reported with the fewest mismatches it matched with
+                reported = 0
+                for mismatches, state in enumerate(states):
+                    hits = state & end_mask & ~reported
+                    if hits:
+                        self.report_hits(hits, pos, result_manager, record, offset, mismatches)
+                        reported |= hits
+
+    def report_hits(self, hits, pos, result_manager, record, offset, mismatches=0):
+        # Collect the entries by start position so the output is the same as the tree which lists all the names
+        # sharing a branch
+        entries_by_start = {}
+        while hits:
+            low_bit = hits & -hits
+            seq, entries, masks = self.patterns[self.end_bits[low_bit.bit_length() - 1]]
+            entries_by_start.setdefault(pos - len(masks) + 1, []).extend(entries)
+            hits ^= low_bit
+        for start, entries in sorted(entries_by_start.items()):
+            # need to add 1 to position because loop starts from 0
+            Nucleotides.report_strands(result_manager, offset + start + 1, entries, record, mismatches)
+
+    def find_matches(self, filename, result_manager, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, region=None):
+        SeqScanner.scan_file(self, filename, result_manager, chunk_size, region=region)
+
+    def memory_usage(self):
+        """There are no nodes, the memory is the per position masks plus the 4 Shift-And base masks"""
+        total_length = sum(len(masks) for seq, entries, masks in self.patterns)
+        mask_bytes = sum(sys.getsizeof(mask) for mask in self.base_masks.values())
+        return {"nodes": 0, "bytes": total_length + mask_bytes}
+
+    def print_memory_usage(self):
+        usage = self.memory_usage()
+        print(f"Mask matcher has {usage['bytes']} bytes of pattern masks")
+
+    def print_tree(self):
+        print(f"\nThis matcher has {self.unique_sequence_count} unique restriction enzyme sequences")
+        total_length = sum(len(masks) for seq, entries, masks in self.patterns)
+        print(f"Total pattern length is {total_length} positions")
+        for seq, entries, masks in self.patterns:
+            print(f"{seq} -> {', '.join(Nucleotides.strand_label(entry) for entry in entries)}")
@@ -0,0 +1,112 @@
+#############################################################################
+#
+#   Usage:      Used by the search engines
+#
+#   This File:  Tables describing the 4 basic nucleotides and the IUPAC
+#               ambiguity codes used in the restriction enzyme sequences
+#
+#############################################################################
+
+# The 4 basic nucleotides in the order they are stored in the tree
+BASES = "ACGT"
+
+# Each basic nucleotide gets its own bit so an ambiguity code can be stored as a 4-bit mask of the bases it allows
+NUCLEOTIDE_BITS = {"A": 1, "C": 2, "G": 4, "T": 8}
+
+# Support for DNA ambiguity codes from https://www.dnabaser.com/articles/IUPAC%20ambiguity%20codes.html
+IUPAC_CODES = {
+    # These are the 4 basic nucleotides
+    "A": "A",
+    "C": "C",
+    "G": "G",
+    "T": "T",
+    # The following are combinations of 2 nucleotides
+    "Y": "CT",      # Pyrimidine (C or T)
+    "R": "AG",      # Purine (A or G)
+    "W": "AT",      # Weak (A or T)
+    "S": "CG",      # Strong (G or C)
+    "K": "GT",      # Keto (T or G)
+    "M": "AC",      # Amino (A or C)
+    # The following are combinations of 3 nucleotides
+    "D": "AGT",     # A, G and T (not C)
+    "V": "ACG",     # A, C and G (not T)
+    "H": "ACT",     # A, C and T (not G)
+    "B": "CGT",     # C, G and T (not A)
+    # The following is all 4 nucleotides
+    "N": "ACGT",
+    "X": "ACGT",
+}
+
+# The code for the complementary bases of each code, used to find the sites on the minus strand. The codes for 2
+# complementary bases (S, W and N) are their own complement
+IUPAC_COMPLEMENTS = {
+    "A": "T", "C": "G", "G": "C", "T": "A",
+    "Y": "R", "R": "Y", "W": "W", "S": "S", "K": "M", "M": "K",
+    "D": "H", "V": "B", "H": "D", "B": "V",
+    "N": "N", "X": "X",
+}
+
+# The search engines hold each reference sequence as (enzyme name, strand) so a match on the reverse complement of an
+# enzyme is reported on the minus strand under the enzyme's own name
+FORWARD_STRAND = 1
+REVERSE_STRAND = -1
+# Shown after the name of an enzyme found on the minus strand
+REVERSE_STRAND_TAG = "(-)"
+
+# The same ambiguity codes as 4-bit masks, e.g. Y (C or T) is 2 | 8 = 10
+IUPAC_MASKS = {code: sum(NUCLEOTIDE_BITS[base] for base in bases) for code, bases in IUPAC_CODES.items()}
+
+
+def sequence_to_masks(sequence):
+    """Converts a restriction enzyme recognition sequence into a list of 4-bit nucleotide masks, one per position.
+    Returns None if the sequence contains a character that isn't a supported IUPAC code"""
+    masks = []
+    for code in sequence:
+        mask = IUPAC_MASKS.get(code)
+        if mask is None:
+            return None
+        masks.append(mask)
+    return masks
+
+
+def reverse_complement(sequence):
+    """Returns the sequence read from the other strand, or None if it contains a character that isn't a supported
+    IUPAC code"""
+    try:
+        return ''.join(IUPAC_COMPLEMENTS[code] for code in reversed(sequence))
+    except KeyError:
+        return None
+
+
+def is_palindrome(sequence):
+    """A palindromic site reads the same on both strands, so it only needs to be searched for once"""
+    return reverse_complement(sequence) == sequence
+
+
+def strand_sequences(re_seq_dict, both_strands=False):
+    """Returns the ((name, strand), sequence) pairs to insert into a search engine. With both_strands the reverse
+    complement of every enzyme that isn't palindromic is added on the minus strand"""
+    sequences = [((re_name, FORWARD_STRAND), seq) for re_name, seq in re_seq_dict.items()]
+    if both_strands:
+        for re_name, seq in re_seq_dict.items():
+            reverse_seq = reverse_complement(seq)
+            if reverse_seq is not None and reverse_seq != seq:
+                sequences.append(((re_name, REVERSE_STRAND), reverse_seq))
+    return sequences
+
+
+def report_strands(result_manager, position, entries, record=None, mismatches=0):
+    """Used by the search engines to report the (name, strand) entries found at a position, the names found on each
+    strand are reported separately"""
+    forward_names = [name for name, strand in entries if strand == FORWARD_STRAND]
+    reverse_names = [name for name, strand in entries if strand == REVERSE_STRAND]
+    if forward_names:
+        result_manager.report_match(position, forward_names, record, FORWARD_STRAND, mismatches)
+    if reverse_names:
+        result_manager.report_match(position, reverse_names, record, REVERSE_STRAND, mismatches)
+
+
+def strand_label(entry):
+    """The name of a (name, strand) entry as the print_tree() methods show it"""
+    name, strand = entry
+    return name + REVERSE_STRAND_TAG if strand == REVERSE_STRAND else name
@@ -0,0 +1,109 @@
+#############################################################################
+#
+#   Usage:      Used by main script Regulon.py with -engine=numpy
+#
+#   This File:  Searches for the reference sequences using NumPy. The DNA
+#               sequence is encoded as an array of numbers once and each
+#               restriction enzyme is tested at every position at the same
+#               time by AND-ing shifted arrays of which bases match
+#
+#############################################################################
+
+# NumPy is optional, only this engine needs it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# import the mask matcher which compiles the sequences into 4-bit nucleotide masks
+import MaskMatcher
+import Nucleotides
+
+
+def encode_sequence(dna_sequence):
+    """Converts the DNA sequence into a uint8 array holding the 4-bit nucleotide mask of each base, which is 0 for
+    anything other than A, C, G and T so it never matches"""
+    lookup = numpy.zeros(256, dtype=numpy.uint8)
+    for base, bit in Nucleotides.NUCLEOTIDE_BITS.items():
+        lookup[ord(base)] = bit
+    return lookup[numpy.frombuffer(dna_sequence.encode("ascii", "replace"), dtype=numpy.uint8)]
+
+
+class RENumpyMatcher(MaskMatcher.REMaskMatcher):
+    """Uses the same compiled patterns as the REMaskMatcher but replaces the per base Shift-And loop with NumPy
+    operations over the whole chunk of DNA sequence. Every pattern is reported at every position it matches, so
+    the results are the same as the trie with -automaton rather than the plain trie, which only reports the
+    shortest sequence found at each position"""
+
+    def match_positions(self, dna_sequence):
+        """Returns a list with an integer array for each pattern, holding the positions in the DNA sequence where
+        that pattern starts, counting from 0"""
+        encoded = encode_sequence(dna_sequence)
+        dna_seq_length = len(encoded)
+        # Boolean array of the positions that match each 4-bit mask, only worked out for the masks actually used
+        members = {}
+        positions = []
+        for seq, entries, masks in self.patterns:
+            start_count = dna_seq_length - len(masks) + 1
+            if start_count <= 0:
+                positions.append(numpy.empty(0, dtype=numpy.int64))
+                continue
+            hits = numpy.ones(start_count, dtype=bool)
+            for index, mask in enumerate(masks):
+                member = members.get(mask)
+                if member is None:
+                    member = members[mask] = (encoded & mask) != 0
+                # Shift the membership array so position i lines up with position i + index of the DNA sequence
+                hits &= member[index:index + start_count]
+            positions.append(numpy.flatnonzero(hits))
+        return positions
+
+    def near_positions(self, dna_sequence):
+        """Same as match_positions() but allows up to max_mismatches positions of each pattern to differ. Returns a
+        list with a pair of integer arrays for each pattern, the positions where it starts and the number of
+        mismatches at each of them. Anything other than the 4 basic nucleotides is never allowed as a mismatch"""
+        encoded = encode_sequence(dna_sequence)
+        dna_seq_length = len(encoded)
+        # Running count of the characters that aren't nucleotides, so a window containing one can be found with a
+        # single subtraction
+        gaps = numpy.concatenate(([0], numpy.cumsum(encoded == 0)))
+        members = {}
+        sites = []
+        for seq, entries, masks in self.patterns:
+            start_count = dna_seq_length - len(masks) + 1
+            if start_count <= 0:
+                sites.append((numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)))
+                continue
+            mismatches = numpy.zeros(start_count, dtype=numpy.int16)
+            for index, mask in enumerate(masks):
+                member = members.get(mask)
+                if member is None:
+                    member = members[mask] = (encoded & mask) != 0
+                mismatches += ~member[index:index + start_count]
+            hits = (mismatches <= self.max_mismatches) & (gaps[len(masks):] == gaps[:start_count])
+            starts = numpy.flatnonzero(hits)
+            sites.append((starts, mismatches[starts]))
+        return sites
+
+    def scan_sequence(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Searches one chunk of a DNA sequence. The offset is the position of the chunk in its FASTA record and
+        the first overlap nucleotides were already searched as the end of the previous chunk"""
+        if self.max_mismatches:
+            sites = self.near_positions(dna_sequence)
+        else:
+            sites = [(starts, numpy.zeros(len(starts), dtype=numpy.int16))
+                     for starts in self.match_positions(dna_sequence)]
+        # Collect the (name, strand) entries by start position and length so the output is the same as the tree which
+        # lists all the names sharing a branch
+        entries_by_site = {}
+        for (seq, entries, masks), (starts, mismatches) in zip(self.patterns, sites):
+            # Anything ending inside the overlap was reported with the previous chunk
+            keep = starts + len(masks) > overlap
+            for start, site_mismatches in zip(starts[keep].tolist(), mismatches[keep].tolist()):
+                entries_by_site.setdefault((start, len(masks), site_mismatches), []).extend(entries)
+        for (start, length, mismatches), entries in sorted(entries_by_site.items()):
+            # need to add 1 to position because loop starts from 0
+            Nucleotides.report_strands(result_manager, offset + start + 1, entries, record, mismatches)
+
+    def print_memory_usage(self):
+        usage = self.memory_usage()
+        print(f"NumPy matcher has {usage['bytes']} bytes of pattern masks")
@@ -0,0 +1,152 @@
+#############################################################################
+#
+#   Usage:      Used by main script Regulon.py with -jobs=N
+#
+#   This File:  Splits the DNA sequence from seq_file=filename into
+#               overlapping shards and searches them in a pool of
+#               processes, merging the matches back into one results
+#               manager
+#
+#############################################################################
+
+# Import standard modules
+import os
+import time
+import threading
+import multiprocessing
+# import utility module to handle reading the source files
+import FileHandler
+import SeqScanner
+import SeqStore
+import RunStats
+
+# Smallest shard worth sending to another process
+MIN_SHARD_SIZE = 10000
+# Number of shards read ahead of the searches for each process, so the whole file isn't held in memory
+SHARDS_AHEAD_PER_JOB = 2
+# Seconds the feeder thread waits for room to read another shard before checking whether the search has stopped
+READ_AHEAD_WAIT = 0.1
+
+# The search engine used by the worker processes. When the processes are forked they share the copy built by the
+# main process, otherwise it is sent to each worker once when the pool starts rather than with every shard
+worker_engine = None
+
+
+class Match_Collector():
+    """Stands in for the Result_Manager inside a worker process, just keeps the matches so they can be sent back"""
+
+    def __init__(self):
+        self.matches = []
+
+    def report_match(self, position, re_list, record=None, strand=1, mismatches=0):
+        self.matches.append((position, list(re_list), record, strand, mismatches))
+
+
+def init_worker(engine):
+    global worker_engine
+    worker_engine = engine
+
+
+def search_shard(shard):
+    """Runs in a worker process, searches one shard and returns where the shard was and the matches found, along
+    with the counters from the run statistics so they can be added to the ones in the main process"""
+    record_name, window_offset, window, window_overlap = shard
+    collector = Match_Collector()
+    RunStats.stats.reset()
+    worker_engine.scan_sequence(window, collector, record_name, window_offset, window_overlap)
+    return (record_name, window_offset, len(window), window_overlap), collector.matches, RunStats.stats.counters
+
+
+def get_shard_size(filename, jobs, chunk_size, region=None):
+    # Aim for a few shards per process so they all finish at about the same time, but keep them no bigger than the
+    # chunk size so memory stays bounded
+    if SeqStore.is_seq_store(filename):
+        # The index of a store gives the number of nucleotides to search without reading any of them
+        try:
+            seq_store = SeqStore.Seq_Store(filename)
+            try:
+                if region is not None:
+                    record_name, start, end = SeqStore.parse_region(region)
+                    record_length = seq_store.get_record(record_name)["length"]
+                    file_size = (record_length if end is None else min(end, record_length)) - start
+                else:
+                    file_size = seq_store.total_length()
+            finally:
+                seq_store.close()
+        except ValueError:
+            # Reported when the shards are read
+            return chunk_size
+    else:
+        try:
+            file_size = os.path.getsize(filename)
+        except OSError:
+            return chunk_size
+    return max(min(chunk_size, file_size // (jobs * 4)), MIN_SHARD_SIZE)
+
+
+def find_matches_parallel(engine, filename, result_manager, jobs, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE,
+                          region=None):
+    """Same as engine.find_matches() but the shards are searched by jobs processes. Shards overlap by one less than
+    the longest reference sequence and matches ending inside the overlap are skipped by the engine, so a site at a
+    shard boundary is reported exactly once"""
+    global worker_engine
+    print(f"Longest reference sequence is {engine.get_tree_depth()} nucleotides long")
+    overlap = max(engine.get_tree_depth() - 1, 0)
+    shard_size = get_shard_size(filename, jobs, chunk_size, region)
+    shards, read_size = SeqScanner.get_windows(filename, overlap, shard_size, region)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        worker_engine = engine
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(engine,))
+
+    # The shards are read on the pool's feeder thread while the processes search the ones before them and the
+    # main process merges the matches, but no more than a couple of shards per process are read ahead
+    read_ahead = threading.BoundedSemaphore(jobs * SHARDS_AHEAD_PER_JOB)
+    # Set when the search stops, even on an error or Ctrl-C, so the feeder thread stops waiting to read the next
+    # shard and the pool can shut down
+    stop_reading = threading.Event()
+
+    def read_shards():
+        while True:
+            while not read_ahead.acquire(timeout=READ_AHEAD_WAIT):
+                if stop_reading.is_set():
+                    return
+            if stop_reading.is_set():
+                return
+            start = time.perf_counter()
+            shard = next(shards, None)
+            RunStats.stats.add_time("read_sequence", time.perf_counter() - start)
+            if shard is None:
+                return
+            yield shard
+
+    dna_seq_length = 0
+    progress = RunStats.Progress(f"Searching {filename}", read_size)
+    bytes_read_before = RunStats.stats.counters.get("bytes_read", 0)
+    with pool:
+        try:
+            shard_results = pool.imap(search_shard, read_shards())
+            while True:
+                # Time spent waiting for the processes to finish the next shard
+                start = time.perf_counter()
+                shard_result = next(shard_results, None)
+                RunStats.stats.add_time("scan", time.perf_counter() - start)
+                if shard_result is None:
+                    break
+                read_ahead.release()
+                (record_name, window_offset, window_length, window_overlap), matches, counters = shard_result
+                RunStats.stats.merge_counters(counters)
+                RunStats.stats.add("bases_scanned", window_length - window_overlap)
+                result_manager.set_record_length(record_name, window_offset + window_length)
+                dna_seq_length += window_length - window_overlap
+                for position, re_list, record, strand, mismatches in matches:
+                    result_manager.report_match(position, re_list, record, strand, mismatches)
+                progress.update(RunStats.stats.counters.get("bytes_read", 0) - bytes_read_before)
+        finally:
+            stop_reading.set()
+    progress.finish()
+    worker_engine = None
+    print(f"DNA sequence is {dna_seq_length} nucleotides long")
+    return dna_seq_length
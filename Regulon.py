@@ -11,18 +11,63 @@
 #################################################################
 
 import sys
-import SeqTree
+import FileHandler
+import SearchEngines
+import ParallelSearch
+import TreeCache
+import SeqIndex
+import RunStats
 import ResultManager
 
 # used to hold the names of the 2 files and set the default output mode to display on the screen
 files = {"re_file" : "" , "seq_file" : "" , "out_file" : "screen"}
+# used to hold the search settings that can be changed with the -options on the command line
+options = {"automaton" : False, "engine" : "trie", "memory" : False,
+           "chunk_size" : FileHandler.DEFAULT_CHUNK_SIZE, "jobs" : 1, "cache" : True,
+           "cache_dir" : TreeCache.DEFAULT_CACHE_DIR, "out_format" : None, "max_matches" : None,
+           "stats" : False, "stats_file" : "", "profile" : None, "both_strands" : False,
+           "max_mismatches" : 0, "digest" : [], "pair_sizes" : None, "region" : None,
+           "index" : False, "index_dir" : SeqIndex.DEFAULT_INDEX_DIR, "index_memory" : SeqIndex.DEFAULT_MAX_BYTES}
 
 def display_useage_info():
     print("\ncommand line usage:  Regulon re_file=filename seq_file=filename [out_file=filename] -options\n")
     print("Mandatory: re_file is the name of the text file containing the list of names and sequences of the restriction enzymes")
     print("Mandatory: seq_file is the name of the text file containing the DNA sequence to be searched in FASTA format")
     print("Optional:  out_file is the name of results file, if not used the rersults will be diplayed on the screen")
-    print("and the options can be any of -h/-help (this help page)\n")
+    print("and the options can be any of -h/-help (this help page)")
+    print("                                  -automaton (trie only, scan the DNA sequence in a single pass using Aho-Corasick links)")
+    print("                                  -engine=trie|mask|compact|numpy (trie expands the ambiguity codes into a tree, mask")
+    print("                                                     matches them directly which uses far less memory for degenerate")
+    print("                                                     enzymes, compact is the same tree stored in flat arrays and numpy")
+    print("                                                     tests every position at once, which needs NumPy installed)")
+    print("                                  -both_strands (also find the sites on the minus strand, palindromic sites are")
+    print("                                                 only reported once, on the plus strand)")
+    print("                                  -mismatches=N (also report near-sites that differ from a recognition sequence")
+    print("                                                 in up to N positions, fastest with the mask engine)")
+    print("                                  -digest=name,name (show the fragment lengths from cutting with all the enzymes")
+    print("                                                     listed, using the cut positions marked in re_file. Turns")
+    print("                                                     on -both_strands, and -automaton for the trie)")
+    print("                                  -pairs=min-max (list the pairs of enzymes whose double digest gives fragments")
+    print("                                                  of min to max bases)")
+    print("                                  -region=record:start-end (only search that part of one record, positions count")
+    print("                                                            from 1, fastest when seq_file is a store made by SeqStore)")
+    print("                                  -index (look the enzymes up in a k-mer index of seq_file, built the first time")
+    print("                                          it is used, rather than scanning it. Enzymes that would need too many")
+    print("                                          lookups are still scanned for)")
+    print(f"                                  -index_dir=path (where the indexes are kept, default {SeqIndex.DEFAULT_INDEX_DIR})")
+    print("                                  -index_memory=N (largest index in MB that will be built, default 1024)")
+    print("                                  -memory (display the number of nodes and bytes used by the search engine)")
+    print("                                  -chunk=N (number of nucleotides read from seq_file at a time, default 1000000)")
+    print("                                  -jobs=N (search the DNA sequence with N processes, default 1)")
+    print("                                  -nocache (always build the compact tree from re_file rather than loading it")
+    print("                                            from the cache of compiled trees)")
+    print(f"                                  -cache_dir=path (where compiled trees are cached, default {TreeCache.DEFAULT_CACHE_DIR})")
+    print("                                  -format=tsv|csv|bed (format of out_file, otherwise taken from its extension)")
+    print("                                  -max_matches=N (keep at most N matches in memory, the rest are sorted and")
+    print("                                                  written to temporary files until the results are output)")
+    print("                                  -stats[=filename] (save the time spent in each phase and counters such as nodes")
+    print("                                                     visited and matches found as JSON, or show them on screen)")
+    print("                                  -profile=cprofile|tracemalloc (include a profile of the run in the -stats output)\n")
 
 
 def parse_command_line():
@@ -37,10 +82,75 @@ def parse_command_line():
                 display_useage_info()
             elif opts.__contains__("-help"):
                 display_useage_info()
+            elif opt == "-automaton":
+                options["automaton"] = True
+            elif opt.startswith("-engine=") and opt.split("=")[1] in SearchEngines.ENGINE_NAMES:
+                options["engine"] = opt.split("=")[1]
+            elif opt == "-both_strands":
+                options["both_strands"] = True
+            elif opt.startswith("-mismatches=") and opt.split("=")[1].isdigit():
+                options["max_mismatches"] = int(opt.split("=")[1])
+            elif opt.startswith("-digest=") and opt.split("=", 1)[1]:
+                options["digest"] = opt.split("=", 1)[1].split(",")
+            elif (opt.startswith("-pairs=") and len(opt.split("=")[1].split("-")) == 2
+                  and all(size.isdigit() for size in opt.split("=")[1].split("-"))):
+                options["pair_sizes"] = [int(size) for size in opt.split("=")[1].split("-")]
+            elif opt.startswith("-region=") and opt.split("=", 1)[1]:
+                options["region"] = opt.split("=", 1)[1]
+            elif opt == "-index":
+                options["index"] = True
+            elif opt.startswith("-index_dir=") and opt.split("=", 1)[1]:
+                options["index_dir"] = opt.split("=", 1)[1]
+            elif opt.startswith("-index_memory=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+                options["index_memory"] = int(opt.split("=")[1]) * 1024 * 1024
+            elif opt == "-memory":
+                options["memory"] = True
+            elif opt.startswith("-chunk=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+                options["chunk_size"] = int(opt.split("=")[1])
+            elif opt.startswith("-jobs=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+                options["jobs"] = int(opt.split("=")[1])
+            elif opt == "-nocache":
+                options["cache"] = False
+            elif opt.startswith("-cache_dir=") and opt.split("=", 1)[1]:
+                options["cache_dir"] = opt.split("=", 1)[1]
+            elif opt.startswith("-format=") and opt.split("=")[1] in ResultManager.OUTPUT_FORMATS:
+                options["out_format"] = opt.split("=")[1]
+            elif opt.startswith("-max_matches=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+                options["max_matches"] = int(opt.split("=")[1])
+            elif opt == "-stats" or opt.startswith("-stats="):
+                options["stats"] = True
+                options["stats_file"] = opt.split("=", 1)[1] if "=" in opt else ""
+            elif opt.startswith("-profile=") and opt.split("=")[1] in RunStats.PROFILERS:
+                options["profile"] = opt.split("=")[1]
+                options["stats"] = True
             else:
                 print(f"Unrecognised option: {opt}")
                 display_useage_info()
 
+    # Only the trie has an automaton mode, the other engines already report every site in one pass
+    if options["automaton"] and options["engine"] != "trie":
+        print(f"-automaton only applies to -engine=trie, it is ignored by -engine={options['engine']}")
+        options["automaton"] = False
+
+    # The index covers the whole of seq_file and is searched in this process, so it can't be used for a region and
+    # doesn't use the worker processes
+    if options["index"] and options["region"]:
+        print(f"-index can't be used with -region, searching {options['region']} without the index")
+        options["index"] = False
+    if options["index"] and options["jobs"] > 1:
+        print("-jobs is ignored with -index, the index is searched in a single process")
+        options["jobs"] = 1
+
+    # Digests need every cut, which means the sites on both strands and every enzyme at a position rather than only
+    # the shortest, which the trie only finds as an automaton
+    if options["digest"] or options["pair_sizes"]:
+        if not options["both_strands"]:
+            print("Searching both strands as -digest and -pairs need the cuts on the minus strand too")
+            options["both_strands"] = True
+        if options["engine"] == "trie" and not options["automaton"]:
+            print("Using -automaton as -digest and -pairs need every site, not just the shortest at each position")
+            options["automaton"] = True
+
     # now lets extract the filename parameters
     if len(args) < 2:
         print("Sorry didn't understand the format of the command line arguments you used.")
@@ -64,29 +174,68 @@ def parse_command_line():
         return True
 
 
+def create_search_engine():
+    """Returns an empty search engine of the type chosen on the command line, all of them support build_tree() and
+    find_matches()"""
+    cache = TreeCache.Tree_Cache(options["cache_dir"]) if options["cache"] else None
+    return SearchEngines.create_engine(options["engine"], options["automaton"], cache, options["both_strands"],
+                                       options["max_mismatches"])
+
+
 if __name__ == "__main__":
     parse_success = parse_command_line()
     if parse_success:
+        if options["profile"]:
+            RunStats.stats.start_profiler(options["profile"])
+
         # For each run:
         # 1) Initialise a results manager which holds the results of a particular search with a specific combination
         # of Restriction Enzyme (RE) seqeunces and a DNA sequence
-        result_manager = ResultManager.Result_Manager(files["re_file"], files["seq_file"], files["out_file"])
+        result_manager = ResultManager.Result_Manager(files["re_file"], files["seq_file"], files["out_file"],
+                                                      options["out_format"], options["max_matches"],
+                                                      options["max_mismatches"])
 
         # 2) Load Restriction Enzyme (RE) definition file into tree
         # First get a root node
-        current_RE_tree = SeqTree.RESeqTree()
+        current_RE_tree = create_search_engine()
         if not current_RE_tree:
             print("Couldn't create search tree")
             exit(-1)
 
         # We have a valid root node so build the tree with the sequences in the Restriction Enzyme Definition file
         current_RE_tree.build_tree(files["re_file"])
+        if options["memory"]:
+            current_RE_tree.print_memory_usage()
+        result_manager.set_enzymes(current_RE_tree.re_seq_dict)
+        if options["digest"] or options["pair_sizes"]:
+            result_manager.set_cut_sites(FileHandler.import_cut_sites(files["re_file"]))
 
         # DEBUG
         # current_RE_tree.print_tree()
 
         # 3) Search the tree using a specific sequence file in FASTA format, storing any matches in the results manager
-        current_RE_tree.find_matches(files["seq_file"], result_manager)
+        if options["index"]:
+            SeqIndex.find_matches_indexed(current_RE_tree, files["seq_file"], result_manager, options["index_dir"],
+                                          max_bytes=options["index_memory"], chunk_size=options["chunk_size"])
+        elif options["jobs"] > 1:
+            ParallelSearch.find_matches_parallel(current_RE_tree, files["seq_file"], result_manager, options["jobs"],
+                                                 options["chunk_size"], options["region"])
+        else:
+            current_RE_tree.find_matches(files["seq_file"], result_manager, options["chunk_size"], options["region"])
+
+        # Digests are worked out from the matches before they are output, as that removes any spilled runs
+        if options["digest"]:
+            result_manager.print_digest(options["digest"])
+        if options["pair_sizes"]:
+            result_manager.print_enzyme_pairs(*options["pair_sizes"])
 
         # 4) Results manager dispays the results or saves to file depending on command line arguments used
-        result_manager.print_matches()
+        RunStats.stats.add("matches_emitted", result_manager.get_match_count())
+        with RunStats.stats.timer("write_results"):
+            result_manager.print_matches()
+
+        # 5) Save the time spent in each phase and the counters if asked for on the command line
+        if options["profile"]:
+            RunStats.stats.stop_profiler()
+        if options["stats"]:
+            RunStats.stats.write_summary(options["stats_file"])
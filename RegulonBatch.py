@@ -0,0 +1,324 @@
+#################################################################
+#
+#   Usage:      RegulonBatch re_file=filename seq_files=dir|pattern|manifest [out_dir=path] -options
+#
+#   This File:  Searches many DNA sequence files with one tree. The
+#               tree is built once, the files are handed out one at a
+#               time to a pool of processes that read and search them
+#               while the next files are read ahead on a background
+#               thread, each file gets its own results file and a
+#               summary of all of them is written at the end
+#
+#################################################################
+
+# Import standard modules
+import os
+import sys
+import glob
+import time
+import contextlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+# import utility module to handle reading the source files
+import FileHandler
+import SearchEngines
+import SeqScanner
+import TreeCache
+import RunStats
+import ResultManager
+
+# Number of files waiting in the queue for each process, so a process never waits for the next file
+QUEUED_FILES_PER_JOB = 2
+# Number of files read ahead into the operating system's file cache while the ones before them are searched
+PREFETCH_FILES = 2
+PREFETCH_THREADS = 1
+PREFETCH_BLOCK_SIZE = 1024 * 1024
+SUMMARY_FILENAME = "summary.tsv"
+ENZYME_SUMMARY_FILENAME = "enzyme_summary.tsv"
+SUMMARY_COLUMNS = ["file", "out_file", "records", "bases", "matches", "read_seconds", "scan_seconds",
+                   "write_seconds", "error"]
+
+# used to hold the names of the files and folders given on the command line
+files = {"re_file" : "", "seq_files" : "", "out_dir" : "regulon_results"}
+# used to hold the search settings that can be changed with the -options on the command line
+options = {"automaton" : False, "engine" : "trie", "chunk_size" : FileHandler.DEFAULT_CHUNK_SIZE, "jobs" : 1,
+           "cache" : True, "cache_dir" : TreeCache.DEFAULT_CACHE_DIR, "out_format" : "tsv", "both_strands" : False,
+           "max_mismatches" : 0}
+
+# The search engine used to search the files. When the processes are forked they share the copy built by the main
+# process, otherwise it is sent to each worker once when the pool starts
+worker_engine = None
+
+
+def display_useage_info():
+    print("\ncommand line usage:  RegulonBatch re_file=filename seq_files=dir|pattern|manifest [out_dir=path] -options\n")
+    print("Mandatory: re_file is the name of the text file containing the list of names and sequences of the restriction enzymes")
+    print("Mandatory: seq_files is a folder of FASTA files, a pattern such as constructs/*.fa (in quotes) or a manifest")
+    print("           file listing one FASTA file per line")
+    print("Optional:  out_dir is the folder for the results of each file and the summary, default regulon_results")
+    print("and the options can be any of -h/-help (this help page)")
+    print("                                  -automaton (scan the DNA sequences in a single pass using Aho-Corasick links)")
+    print("                                  -engine=trie|mask|compact|numpy (search engine, see Regulon.py -help)")
+    print("                                  -both_strands (also find the sites on the minus strand)")
+    print("                                  -mismatches=N (also report near-sites with up to N mismatches)")
+    print("                                  -chunk=N (number of nucleotides searched at a time, default 1000000)")
+    print("                                  -jobs=N (search N files at once in separate processes, default 1)")
+    print("                                  -nocache (always build the compact tree from re_file)")
+    print(f"                                  -cache_dir=path (where compiled trees are cached, default {TreeCache.DEFAULT_CACHE_DIR})")
+    print("                                  -format=tsv|csv|bed (format of the results file for each sequence file, default tsv)\n")
+
+
+def parse_command_line():
+    opts = [opt for opt in sys.argv[1:] if opt.startswith("-")]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+
+    for opt in opts:
+        if opt in ("-h", "-help"):
+            display_useage_info()
+        elif opt == "-automaton":
+            options["automaton"] = True
+        elif opt == "-both_strands":
+            options["both_strands"] = True
+        elif opt.startswith("-mismatches=") and opt.split("=")[1].isdigit():
+            options["max_mismatches"] = int(opt.split("=")[1])
+        elif opt.startswith("-engine=") and opt.split("=")[1] in SearchEngines.ENGINE_NAMES:
+            options["engine"] = opt.split("=")[1]
+        elif opt.startswith("-chunk=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+            options["chunk_size"] = int(opt.split("=")[1])
+        elif opt.startswith("-jobs=") and opt.split("=")[1].isdigit() and int(opt.split("=")[1]) > 0:
+            options["jobs"] = int(opt.split("=")[1])
+        elif opt == "-nocache":
+            options["cache"] = False
+        elif opt.startswith("-cache_dir=") and opt.split("=", 1)[1]:
+            options["cache_dir"] = opt.split("=", 1)[1]
+        elif opt.startswith("-format=") and opt.split("=")[1] in ResultManager.OUTPUT_FORMATS:
+            options["out_format"] = opt.split("=")[1]
+        else:
+            print(f"Unrecognised option: {opt}")
+            display_useage_info()
+
+    for arg in args:
+        name, _, value = arg.partition("=")
+        if name in files and value:
+            files[name] = value
+
+    if not files["re_file"] or not files["seq_files"]:
+        print("\nSorry didn't understand the format of the filenames you used.")
+        display_useage_info()
+        return False
+    return True
+
+
+def find_seq_files(source):
+    """Returns the sequence files to search, from a folder, a pattern or a manifest file with one filename per
+    line. Blank lines and lines starting with # in a manifest are ignored, and relative filenames are taken from
+    the folder the manifest is in"""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if not name.startswith(".") and os.path.isfile(os.path.join(source, name)))
+    if any(character in source for character in "*?["):
+        return sorted(filename for filename in glob.glob(source) if os.path.isfile(filename))
+    try:
+        with open(source, "r") as manifest:
+            lines = [line.strip() for line in manifest]
+    except Exception as err:
+        print(f"\nERROR - RegulonBatch.find_seq_files() had a problem with the file: {source}.\nError was: ", err)
+        return []
+    manifest_dir = os.path.dirname(source)
+    return [os.path.join(manifest_dir, line) for line in lines if line and not line.startswith("#")]
+
+
+def get_out_filenames(seq_files, out_dir, out_format):
+    """Names the results file of each sequence file after it, adding a number when 2 sequence files from different
+    folders have the same name"""
+    out_filenames = []
+    used = set()
+    for filename in seq_files:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        out_name = stem
+        number = 2
+        while out_name in used:
+            out_name = f"{stem}_{number}"
+            number += 1
+        used.add(out_name)
+        out_filenames.append(os.path.join(out_dir, f"{out_name}.{out_format}"))
+    return out_filenames
+
+
+def prefetch_file(filename):
+    """Runs on a prefetch thread, reads the file and throws the bytes away so the file is in the operating system's
+    cache by the time it is searched. Only one block is held at a time, however big the file is"""
+    block = bytearray(PREFETCH_BLOCK_SIZE)
+    try:
+        with open(filename, "rb", buffering=0) as seq_file:
+            while seq_file.readinto(block):
+                pass
+    except OSError:
+        # Reported when the file is searched
+        pass
+
+
+def init_worker(engine):
+    global worker_engine
+    worker_engine = engine
+
+
+def search_file(job):
+    """Reads one sequence file, searches it and writes its matches to out_filename. Runs in a worker process, or
+    in the main process when there is only one job, and returns the position of the file in the list, a row of the
+    summary and the number of matches for each enzyme. The file is streamed a chunk at a time, or memory mapped if
+    it is a packed store, so only the name of the file is sent to the worker"""
+    index, filename, out_filename, re_file, out_format, chunk_size, max_mismatches = job
+    result = {"file": filename, "out_file": out_filename, "records": 0, "bases": 0, "matches": 0,
+              "read_seconds": 0.0, "scan_seconds": 0.0, "write_seconds": 0.0, "error": ""}
+    try:
+        with open(filename, "rb"):
+            pass
+    except Exception as err:
+        result["error"] = str(err)
+        return index, result, {}
+    # Only the counters added by this file belong in its row, the ones already there are kept for the run summary
+    counters_before = dict(RunStats.stats.counters)
+    timers_before = dict(RunStats.stats.timers)
+    result_manager = ResultManager.Result_Manager(re_file, filename, out_filename, out_format,
+                                                  max_mismatches=max_mismatches)
+    result_manager.set_enzymes(worker_engine.re_seq_dict)
+    try:
+        # The messages printed for each file would just get mixed up between the processes, the summary covers them
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            SeqScanner.scan_file(worker_engine, filename, result_manager, chunk_size)
+
+            start = time.perf_counter()
+            enzyme_counts = result_manager.get_enzyme_counts()
+            result_manager.print_matches()
+            result["write_seconds"] = time.perf_counter() - start
+    except Exception as err:
+        result_manager.remove_spill_files()
+        result["error"] = str(err)
+        return index, result, {}
+    result["read_seconds"] = RunStats.stats.timers.get("read_sequence", 0.0) - timers_before.get("read_sequence", 0.0)
+    result["scan_seconds"] = RunStats.stats.timers.get("scan", 0.0) - timers_before.get("scan", 0.0)
+    result["records"] = RunStats.stats.counters.get("records_read", 0) - counters_before.get("records_read", 0)
+    result["bases"] = RunStats.stats.counters.get("bases_scanned", 0) - counters_before.get("bases_scanned", 0)
+    result["matches"] = result_manager.get_match_count()
+    return index, result, enzyme_counts
+
+
+def search_files(engine, seq_files, out_filenames):
+    """Searches every file with the engine. The files are handed out one at a time from a shared queue, so a
+    worker that finishes a small file takes the next one while a slow file is still being searched. No more than
+    jobs*2 files are queued at once and each worker reads its own files, which the prefetch thread has already read
+    into the operating system's cache, so even with one job the disk is read while the previous file is searched"""
+    global worker_engine
+    jobs = options["jobs"]
+    queued = threading.BoundedSemaphore(jobs * QUEUED_FILES_PER_JOB)
+
+    def queue_jobs():
+        for filename in seq_files[:PREFETCH_FILES]:
+            prefetcher.submit(prefetch_file, filename)
+        for index, (filename, out_filename) in enumerate(zip(seq_files, out_filenames)):
+            # Wait for a file to finish before queueing another one
+            queued.acquire()
+            if index + PREFETCH_FILES < len(seq_files):
+                prefetcher.submit(prefetch_file, seq_files[index + PREFETCH_FILES])
+            yield (index, filename, out_filename, files["re_file"], options["out_format"], options["chunk_size"],
+                   options["max_mismatches"])
+
+    if jobs == 1:
+        worker_engine = engine
+        pool = None
+    elif "fork" in multiprocessing.get_all_start_methods():
+        worker_engine = engine
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(engine,))
+
+    results = [None] * len(seq_files)
+    enzyme_totals = {name: [0, 0] for name in engine.re_seq_dict}     # files with matches, total matches
+    progress = RunStats.Progress("Searching files", len(seq_files))
+    # Started after the pool so the processes aren't forked while a prefetch thread is running
+    with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as prefetcher:
+        if pool is None:
+            file_results = map(search_file, queue_jobs())
+        else:
+            file_results = pool.imap_unordered(search_file, queue_jobs())
+        for done, (index, result, enzyme_counts) in enumerate(file_results, 1):
+            queued.release()
+            results[index] = result
+            for name, count in enzyme_counts.items():
+                totals = enzyme_totals.setdefault(name, [0, 0])
+                totals[0] += 1 if count else 0
+                totals[1] += count
+            progress.update(done)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    progress.finish()
+    worker_engine = None
+    return results, enzyme_totals
+
+
+def write_summary(results, enzyme_totals, out_dir):
+    """Writes a table with a row for each file and a total row, and a table of how many files and matches each
+    enzyme was found in"""
+    totals = {"file": "TOTAL", "out_file": "", "error": f"{sum(1 for result in results if result['error'])} failed"}
+    for column in ["records", "bases", "matches", "read_seconds", "scan_seconds", "write_seconds"]:
+        totals[column] = sum(result[column] for result in results)
+    summary_filename = os.path.join(out_dir, SUMMARY_FILENAME)
+    enzyme_filename = os.path.join(out_dir, ENZYME_SUMMARY_FILENAME)
+    try:
+        with open(summary_filename, "w") as summary_file:
+            summary_file.write("\t".join(SUMMARY_COLUMNS) + "\n")
+            for row in results + [totals]:
+                summary_file.write("\t".join(format_value(row[column]) for column in SUMMARY_COLUMNS) + "\n")
+        with open(enzyme_filename, "w") as enzyme_file:
+            enzyme_file.write("enzyme\tfiles_with_matches\tmatches\n")
+            for name, (file_count, match_count) in enzyme_totals.items():
+                enzyme_file.write(f"{name}\t{file_count}\t{match_count}\n")
+    except Exception as err:
+        print(f"\nERROR - RegulonBatch.write_summary() had a problem writing to: {out_dir}.\nError was: ", err)
+        return
+    print(f"Searched {len(results)} files, {totals['bases']} nucleotides in {totals['records']} records, "
+          f"found {totals['matches']} matches, {totals['error']}")
+    print(f"Summary saved to {summary_filename} and {enzyme_filename}")
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+
+def create_search_engine():
+    cache = TreeCache.Tree_Cache(options["cache_dir"]) if options["cache"] else None
+    return SearchEngines.create_engine(options["engine"], options["automaton"], cache, options["both_strands"],
+                                       options["max_mismatches"])
+
+
+if __name__ == "__main__":
+    if parse_command_line():
+        start_time = time.perf_counter()
+        seq_files = find_seq_files(files["seq_files"])
+        if not seq_files:
+            print(f"No sequence files found in {files['seq_files']}")
+            exit(-1)
+        try:
+            os.makedirs(files["out_dir"], exist_ok=True)
+        except OSError as err:
+            print(f"\nERROR - RegulonBatch couldn't create the folder: {files['out_dir']}.\nError was: ", err)
+            exit(-1)
+
+        # Build the tree once for all the files
+        current_RE_tree = create_search_engine()
+        if not current_RE_tree:
+            print("Couldn't create search tree")
+            exit(-1)
+        current_RE_tree.build_tree(files["re_file"])
+
+        print(f"Searching {len(seq_files)} files with {options['jobs']} jobs")
+        batch_results, batch_enzyme_totals = search_files(current_RE_tree, seq_files,
+                                                          get_out_filenames(seq_files, files["out_dir"],
+                                                                            options["out_format"]))
+        write_summary(batch_results, batch_enzyme_totals, files["out_dir"])
+        print(f"Finished in {time.perf_counter() - start_time:.2f} seconds")
@@ -0,0 +1,252 @@
+#################################################################
+#
+#   Usage:      RegulonServer [port=N] -options
+#
+#   This File:  Long running search server which keeps the trees for
+#               recently used restriction enzyme files in memory so
+#               each query only pays for the search, not the build
+#
+#################################################################
+
+# Import standard modules
+import sys
+import json
+import socket
+import asyncio
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+# import utility module to handle reading the source files
+import FileHandler
+import SearchEngines
+
+DEFAULT_PORT = 8521
+# Number of built trees kept in memory, the least recently used is dropped when another one is needed
+DEFAULT_MAX_TREES = 4
+# Queries for the same tree that arrive within this many seconds of each other are searched together
+BATCH_DELAY = 0.005
+# A batch is searched straight away once it holds this many nucleotides
+BATCH_MAX_BASES = 1000000
+# Placed between the sequences of a batch. It isn't a nucleotide so no restriction enzyme can match across it
+BATCH_SEPARATOR = "*"
+# Longest query line accepted, the default for asyncio streams is only 64 KB
+MAX_QUERY_BYTES = 256 * 1024 * 1024
+# Threads building trees, kept apart from the searches so a slow build doesn't hold up queries for the other trees
+BUILD_THREADS = 2
+# Threads searching the trees, each tree is only searched by one of them at a time
+SEARCH_THREADS = 4
+
+# used to hold the server settings, changed with key=value arguments and -options on the command line
+settings = {"port" : DEFAULT_PORT, "max_trees" : DEFAULT_MAX_TREES}
+
+
+class Batch_Collector():
+    """Receives the matches from a search of several queries joined together and sorts them back into the query they
+    came from"""
+
+    def __init__(self, starts):
+        self.starts = starts
+        self.matches = [[] for _ in starts]
+
+    def report_match(self, position, re_list, record=None, strand=1, mismatches=0):
+        # position counts from 1 within the joined sequence
+        query_index = bisect.bisect_right(self.starts, position - 1) - 1
+        query_position = position - self.starts[query_index]
+        strand_symbol = "+" if strand >= 0 else "-"
+        for ref_seq_name in re_list:
+            self.matches[query_index].append({"position": query_position, "enzyme": ref_seq_name,
+                                              "strand": strand_symbol, "mismatches": mismatches})
+
+
+class Regulon_Server():
+    """Accepts one JSON query per line on a local socket and answers each one with one JSON line. A query looks like
+    {"re_file": "enzymes.txt", "sequence": "GAATTC...", "engine": "mask", "both_strands": true, "max_mismatches": 1}
+    where engine, both_strands and max_mismatches are optional. The answer lists the matches as
+    {"position": n, "enzyme": name, "strand": "+", "mismatches": 0} with positions counting from 1"""
+
+    def __init__(self, max_trees=DEFAULT_MAX_TREES):
+        self.max_trees = max_trees
+        # Futures for the built trees keyed by (MD5 of the enzyme file, engine name, automaton for the trie, both
+        # strands, mismatches), most recently used last. Holding the future means queries arriving while a tree is
+        # being built wait for it rather than building it again. Each future gives the tree and its lock
+        self.trees = OrderedDict()
+        # Queries waiting to be searched, keyed the same way as the trees
+        self.pending = {}
+        # A tree isn't safe to use from 2 threads at once, so it is only built or searched while its lock is held,
+        # but different trees are built and searched at the same time
+        self.build_executor = ThreadPoolExecutor(max_workers=BUILD_THREADS)
+        self.search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS)
+        self.queries_answered = 0
+        self.batches_searched = 0
+
+    async def get_tree(self, key, re_file):
+        tree_future = self.trees.get(key)
+        if tree_future is not None:
+            self.trees.move_to_end(key)
+        else:
+            tree_future = self.trees[key] = asyncio.ensure_future(self.build_tree(key, re_file))
+            while len(self.trees) > self.max_trees:
+                self.trees.popitem(last=False)
+        try:
+            return await tree_future
+        except Exception:
+            # Don't keep a failed build, the next query can try again
+            if self.trees.get(key) is tree_future:
+                del self.trees[key]
+            raise
+
+    async def build_tree(self, key, re_file):
+        """Returns the tree for the key along with the lock to hold while it is used"""
+        checksum, engine_name, use_automaton, both_strands, max_mismatches = key
+        tree, tree_lock = self.take_outdated_tree(key, re_file)
+        if tree is None:
+            tree = SearchEngines.create_engine(engine_name, use_automaton, both_strands=both_strands,
+                                               max_mismatches=max_mismatches)
+            tree_lock = asyncio.Lock()
+        if tree is None:
+            raise ValueError(f"engine {engine_name} is not available")
+        loop = asyncio.get_running_loop()
+        # An outdated tree may still be searching a batch for its old key
+        async with tree_lock:
+            await loop.run_in_executor(self.build_executor, tree.build_tree, re_file)
+        return tree, tree_lock
+
+    def take_outdated_tree(self, key, re_file):
+        """Returns a tree built from an earlier version of the same enzyme file and its lock, if one is held and its
+        engine can apply just the changes to the file. The tree is moved from its old key so it isn't used for that
+        any more"""
+        for old_key, tree_future in list(self.trees.items()):
+            if (old_key[1:] != key[1:] or old_key == key or not tree_future.done() or tree_future.cancelled()
+                    or tree_future.exception()):
+                continue
+            tree, tree_lock = tree_future.result()
+            if hasattr(tree, "reload_enzymes") and tree.re_filename == re_file:
+                del self.trees[old_key]
+                return tree, tree_lock
+        return None, None
+
+    async def search(self, re_file, sequence, engine_name="trie", use_automaton=False, both_strands=False,
+                     max_mismatches=0):
+        """Queues the sequence to be searched with the next batch for the same tree and waits for its matches"""
+        loop = asyncio.get_running_loop()
+        # The enzyme file is read again for every query to see if it has changed, which isn't done on the event loop
+        checksum = await loop.run_in_executor(None, FileHandler.file_checksum, re_file)
+        if not checksum:
+            raise ValueError(f"can't read re_file {re_file}")
+        # Only the trie has an automaton mode, so the other engines share one tree whatever the query asked for
+        use_automaton = use_automaton and engine_name == "trie"
+        key = (checksum, engine_name, use_automaton, both_strands, max_mismatches)
+        future = loop.create_future()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = {"re_file": re_file, "queries": [], "bases": 0}
+            loop.call_later(BATCH_DELAY, self.start_batch, key)
+        batch["queries"].append((sequence, future))
+        batch["bases"] += len(sequence)
+        if batch["bases"] >= BATCH_MAX_BASES:
+            self.start_batch(key)
+        return await future
+
+    def start_batch(self, key):
+        batch = self.pending.pop(key, None)
+        if batch is not None:
+            asyncio.ensure_future(self.search_batch(key, batch))
+
+    async def search_batch(self, key, batch):
+        queries = batch["queries"]
+        try:
+            tree, tree_lock = await self.get_tree(key, batch["re_file"])
+            # Join the sequences into one so the tree is only walked once for the whole batch
+            starts = []
+            position = 0
+            for sequence, future in queries:
+                starts.append(position)
+                position += len(sequence) + len(BATCH_SEPARATOR)
+            joined_sequence = BATCH_SEPARATOR.join(sequence for sequence, future in queries)
+            collector = Batch_Collector(starts)
+            loop = asyncio.get_running_loop()
+            async with tree_lock:
+                await loop.run_in_executor(self.search_executor, tree.scan_sequence, joined_sequence, collector)
+        except Exception as err:
+            for sequence, future in queries:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        self.batches_searched += 1
+        for (sequence, future), matches in zip(queries, collector.matches):
+            if not future.done():
+                future.set_result(matches)
+
+    async def handle_client(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response = await self.answer_query(line)
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+        writer.close()
+
+    async def answer_query(self, line):
+        try:
+            query = json.loads(line)
+            if query.get("command") == "status":
+                return {"trees": len(self.trees), "queries_answered": self.queries_answered,
+                        "batches_searched": self.batches_searched}
+            engine_name = query.get("engine", "trie")
+            if engine_name not in SearchEngines.ENGINE_NAMES:
+                return {"error": f"unrecognised engine {engine_name}"}
+            max_mismatches = int(query.get("max_mismatches", 0))
+            if max_mismatches < 0:
+                return {"error": f"max_mismatches must be 0 or more, not {max_mismatches}"}
+            # Line breaks and spaces are allowed in the sequence, as if it was cut from a FASTA file
+            sequence = ''.join(query["sequence"].split())
+            matches = await self.search(query["re_file"], sequence, engine_name, bool(query.get("automaton")),
+                                        bool(query.get("both_strands")), max_mismatches)
+        except Exception as err:
+            return {"error": str(err)}
+        self.queries_answered += 1
+        return {"sequence_length": len(sequence), "matches": matches}
+
+    async def serve(self, port):
+        server = await asyncio.start_server(self.handle_client, "127.0.0.1", port, limit=MAX_QUERY_BYTES)
+        print(f"Regulon server listening on 127.0.0.1:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def send_query(query, port=DEFAULT_PORT):
+    """Sends one query to a running server and returns its answer, for use by scripts"""
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall((json.dumps(query) + "\n").encode("utf-8"))
+        answer = b""
+        while not answer.endswith(b"\n"):
+            block = connection.recv(65536)
+            if not block:
+                break
+            answer += block
+    return json.loads(answer)
+
+
+def parse_command_line():
+    for arg in sys.argv[1:]:
+        if arg.startswith("port=") and arg.split("=")[1].isdigit():
+            settings["port"] = int(arg.split("=")[1])
+        elif arg.startswith("-trees=") and arg.split("=")[1].isdigit() and int(arg.split("=")[1]) > 0:
+            settings["max_trees"] = int(arg.split("=")[1])
+        else:
+            print(f"Unrecognised argument: {arg}")
+            print("\ncommand line usage:  RegulonServer [port=N] -options\n")
+            print(f"Optional:  port is the local port to listen on, default {DEFAULT_PORT}")
+            print(f"and the options can be -trees=N (number of built trees kept in memory, default {DEFAULT_MAX_TREES})\n")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    if parse_command_line():
+        regulon_server = Regulon_Server(settings["max_trees"])
+        try:
+            asyncio.run(regulon_server.serve(settings["port"]))
+        except KeyboardInterrupt:
+            print("\nRegulon server stopped")
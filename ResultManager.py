@@ -1,25 +1,337 @@
 # module to hold the matches that were found
 
+import os
+import heapq
+import struct
+import tempfile
+from array import array
+import Nucleotides
+
+# Formats that can be used for out_file, picked from the file extension unless given with -format=
+OUTPUT_FORMATS = ["tsv", "csv", "bed"]
+# Number of output lines joined together before being written
+WRITE_BATCH_SIZE = 10000
+# Layout of one match in a spilled run file: record id, position, enzyme id, strand and mismatches
+RUN_RECORD = struct.Struct("<iqibb")
+# Number of matches read back from each run file at a time when they are merged
+RUN_READ_BATCH = 4096
+
+
 class Result_Manager():
     """ This class holds the results of a particular search and is specific to the combination of RE sequences
-     and DNA sequences used in the search"""
+     and DNA sequences used in the search. The matches are kept in columns of arrays rather than one object each,
+     and if max_matches is set they are sorted and spilled to temporary files on disk whenever that many have
+     been collected, so the memory used is bounded however many matches are found"""
 
-    def __init__(self, re_file, seq_file, out_file=None):
+    def __init__(self, re_file, seq_file, out_file=None, out_format=None, max_matches=None, max_mismatches=0):
         self.re_file = re_file
         self.seq_file = seq_file
         self.out_file = out_file
-        self.matches = dict()
+        self.out_format = out_format
+        self.max_matches = max_matches
+        # When the search allows mismatches the number of them is written out with each match
+        self.max_mismatches = max_mismatches
+
+        # One entry in each column per match
+        self.positions = array('q')     # start of the match counting from 1
+        self.enzyme_ids = array('i')    # index into enzyme_names
+        self.strands = array('b')       # 1 for the forward strand and -1 for the reverse strand
+        self.record_ids = array('i')    # index into record_names
+        self.mismatches = array('b')    # number of positions that differ from the recognition sequence
+
+        # Names are only stored once, the columns hold their index in these lists
+        self.enzyme_names = []
+        self.enzyme_ids_by_name = {}
+        self.enzyme_lengths = []
+        self.record_names = []
+        self.record_ids_by_name = {}
+        self.record_lengths = {}
+
+        # Where each enzyme cuts relative to the start of its site, see FileHandler.parse_cut_site(), and the cut
+        # positions worked out from the matches by get_cut_positions()
+        self.cut_sites = {}
+        self.cut_positions = None
+
+        # Sorted runs of matches written to disk when max_matches is reached
+        self.spill_dir = None
+        self.spill_files = []
+        self.match_count = 0
+
+    def set_enzymes(self, re_seq_dict):
+        """Registers the enzymes in the order of the restriction enzyme definition file so their ids, and the order
+        of matches at the same position, follow the file. The sequence lengths are used for the end of a match"""
+        for re_name, seq in re_seq_dict.items():
+            enzyme_id = self.get_enzyme_id(re_name)
+            self.enzyme_lengths[enzyme_id] = len(seq)
+
+    def set_cut_sites(self, cut_sites):
+        self.cut_sites = cut_sites
+        self.cut_positions = None
+
+    def set_record_length(self, record, length):
+        """Called as the sequence is searched so the last fragment of a digest can be worked out"""
+        if length > self.record_lengths.get(record, 0):
+            self.record_lengths[record] = length
+
+    def get_enzyme_id(self, ref_seq_name):
+        enzyme_id = self.enzyme_ids_by_name.get(ref_seq_name)
+        if enzyme_id is None:
+            enzyme_id = len(self.enzyme_names)
+            self.enzyme_names.append(ref_seq_name)
+            self.enzyme_lengths.append(0)
+            self.enzyme_ids_by_name[ref_seq_name] = enzyme_id
+        return enzyme_id
+
+    def get_record_id(self, record):
+        record_id = self.record_ids_by_name.get(record)
+        if record_id is None:
+            record_id = len(self.record_names)
+            self.record_names.append(record)
+            self.record_ids_by_name[record] = record_id
+        return record_id
+
+    def get_match_count(self):
+        return self.match_count
+
+    def add_match(self, position, ref_seq_name, record=None, strand=1, mismatches=0):
+        self.positions.append(position)
+        self.enzyme_ids.append(self.get_enzyme_id(ref_seq_name))
+        self.strands.append(strand)
+        self.record_ids.append(self.get_record_id(record))
+        self.mismatches.append(mismatches)
+        self.match_count += 1
+        self.cut_positions = None
+        if self.max_matches and len(self.positions) >= self.max_matches:
+            self.spill_run()
+
+    def report_match(self, position, re_list, record=None, strand=1, mismatches=0):
+        """Called by the search engines for each match found, position is the start of the match counting from 1"""
+        for ref_seq_name in re_list:
+            self.add_match(position, ref_seq_name, record, strand, mismatches)
+
+    def sorted_rows(self):
+        """Returns the matches held in memory as (record id, position, enzyme id, strand, mismatches) sorted in that
+        order"""
+        rows = zip(self.record_ids, self.positions, self.enzyme_ids, self.strands, self.mismatches)
+        return sorted(rows)
 
-    def add_match(self, position, ref_seq_name):
-        self.matches[position] = ref_seq_name
+    def clear_columns(self):
+        self.positions = array('q')
+        self.enzyme_ids = array('i')
+        self.strands = array('b')
+        self.record_ids = array('i')
+        self.mismatches = array('b')
+
+    def spill_run(self):
+        """Sorts the matches held in memory, writes them to a temporary run file and empties the columns"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="regulon_")
+        run_filename = os.path.join(self.spill_dir, f"run{len(self.spill_files)}.bin")
+        with open(run_filename, "wb") as run_file:
+            run_file.write(b''.join(RUN_RECORD.pack(*row) for row in self.sorted_rows()))
+        self.spill_files.append(run_filename)
+        self.clear_columns()
+
+    def read_run(self, run_filename):
+        with open(run_filename, "rb") as run_file:
+            while True:
+                block = run_file.read(RUN_RECORD.size * RUN_READ_BATCH)
+                if not block:
+                    break
+                yield from RUN_RECORD.iter_unpack(block)
+
+    def all_rows(self):
+        """Every match in sorted order without repeats, merging the spilled runs with the matches still in memory"""
+        runs = [self.read_run(run_filename) for run_filename in self.spill_files]
+        runs.append(iter(self.sorted_rows()))
+        previous_row = None
+        for row in heapq.merge(*runs):
+            if row != previous_row:
+                yield row
+            previous_row = row
+
+    def get_enzyme_counts(self):
+        """Returns the number of matches found for each enzyme, in the order of the restriction enzyme definition
+        file, including the spilled runs"""
+        counts = [0] * len(self.enzyme_names)
+        for record_id, position, enzyme_id, strand, mismatches in self.all_rows():
+            counts[enzyme_id] += 1
+        return dict(zip(self.enzyme_names, counts))
+
+    def get_cut_positions(self):
+        """Returns {record: {enzyme name: sorted array of cut positions}} from the exact matches, where a cut position
+        is the number of bases before the cut on the plus strand. Near-sites found with mismatches aren't cut. Built
+        once from the merged matches and kept until another match is added"""
+        if self.cut_positions is not None:
+            return self.cut_positions
+        cuts_by_record = {}
+        for record_id, position, enzyme_id, strand, mismatches in self.all_rows():
+            if mismatches:
+                continue
+            name = self.enzyme_names[enzyme_id]
+            length = self.enzyme_lengths[enzyme_id]
+            top, bottom = self.cut_sites.get(name, (length // 2, length - length // 2))
+            # On the minus strand the enzyme's bottom strand cut is the one on the plus strand, measured from the end
+            cut = position - 1 + (top if strand >= 0 else length - bottom)
+            cuts_by_record.setdefault(self.record_names[record_id], {}).setdefault(name, []).append(cut)
+        # The rows are in order of the start of the sites, which is nearly the order of the cuts
+        self.cut_positions = {record: {name: array('q', sorted(set(cuts))) for name, cuts in cuts_by_name.items()}
+                              for record, cuts_by_name in cuts_by_record.items()}
+        return self.cut_positions
+
+    def digest(self, enzyme_names):
+        """Returns {record: list of fragment lengths in order} for cutting every record with all the enzymes at once.
+        Each enzyme's cut positions are already sorted so they are merged rather than sorted again. Cuts outside
+        the record are ignored. Raises ValueError if an enzyme isn't one of those searched for"""
+        unknown_names = [name for name in enzyme_names if name not in self.enzyme_ids_by_name]
+        if unknown_names:
+            raise ValueError(f"{', '.join(unknown_names)} not found in {self.re_file}")
+        cut_positions = self.get_cut_positions()
+        records = list(self.record_lengths) + [record for record in cut_positions if record not in self.record_lengths]
+        fragments = {}
+        for record in records:
+            cuts_by_name = cut_positions.get(record, {})
+            record_length = self.record_lengths.get(record)
+            lengths = []
+            previous_cut = 0
+            for cut in heapq.merge(*(cuts_by_name.get(name, ()) for name in enzyme_names)):
+                if cut <= previous_cut or (record_length is not None and cut >= record_length):
+                    continue
+                lengths.append(cut - previous_cut)
+                previous_cut = cut
+            if record_length is not None:
+                lengths.append(record_length - previous_cut)
+            fragments[record] = lengths
+        return fragments
+
+    def find_enzyme_pairs(self, min_size, max_size):
+        """Tries the double digest of every pair of enzymes that cut and returns (first name, second name, number of
+        fragments from min_size to max_size bases long) for the pairs giving at least one, using the cut positions
+        already found rather than searching the sequence again"""
+        cut_positions = self.get_cut_positions()
+        names = [name for name in self.enzyme_names if any(name in cuts for cuts in cut_positions.values())]
+        pairs = []
+        for index, first_name in enumerate(names):
+            for second_name in names[index + 1:]:
+                fragment_count = sum(1 for lengths in self.digest([first_name, second_name]).values()
+                                     for length in lengths if min_size <= length <= max_size)
+                if fragment_count:
+                    pairs.append((first_name, second_name, fragment_count))
+        return pairs
+
+    def print_digest(self, enzyme_names):
+        try:
+            fragments = self.digest(enzyme_names)
+        except ValueError as err:
+            print(f"\nERROR - ResultManager.print_digest() couldn't digest with {' + '.join(enzyme_names)}.\nError was: ",
+                  err)
+            return
+        print(f"Digest with {' + '.join(enzyme_names)}:")
+        for record, lengths in fragments.items():
+            print(f"{record or os.path.basename(self.seq_file)}: {len(lengths)} fragments {lengths}")
+
+    def print_enzyme_pairs(self, min_size, max_size):
+        pairs = self.find_enzyme_pairs(min_size, max_size)
+        print(f"{len(pairs)} enzyme pairs give fragments of {min_size} to {max_size} bases:")
+        for first_name, second_name, fragment_count in pairs:
+            print(f"{first_name} + {second_name}: {fragment_count} fragments")
+
+    def remove_spill_files(self):
+        for run_filename in self.spill_files:
+            try:
+                os.remove(run_filename)
+            except OSError:
+                pass
+        if self.spill_dir:
+            try:
+                os.rmdir(self.spill_dir)
+            except OSError:
+                pass
+        self.spill_files = []
+        self.spill_dir = None
 
     def print_files_used(self):
         print(f"RE file: {self.re_file}")
         print(f"Seq file: {self.seq_file}")
 
+    def get_out_format(self):
+        if self.out_format:
+            return self.out_format
+        extension = os.path.splitext(self.out_file)[1].lstrip(".").lower()
+        return extension if extension in OUTPUT_FORMATS else "tsv"
+
+    def format_rows(self, rows, out_format):
+        """Converts (record id, position, enzyme id, strand, mismatches) rows into lines of text in the format
+        chosen"""
+        seq_name = os.path.basename(self.seq_file)
+        separator = "," if out_format == "csv" else "\t"
+        for record_id, position, enzyme_id, strand, mismatches in rows:
+            record = self.record_names[record_id]
+            name = self.enzyme_names[enzyme_id]
+            strand_symbol = "+" if strand >= 0 else "-"
+            end = position + max(self.enzyme_lengths[enzyme_id], 1) - 1
+            if out_format == "bed":
+                # BED counts from 0 and the end is one past the last base. The score column holds the mismatches
+                yield f"{record or seq_name}\t{position - 1}\t{end}\t{name}\t{mismatches}\t{strand_symbol}\n"
+            elif self.max_mismatches:
+                yield separator.join((record or "", str(position), str(end), name, strand_symbol,
+                                      str(mismatches))) + "\n"
+            else:
+                yield separator.join((record or "", str(position), str(end), name, strand_symbol)) + "\n"
+
+    def write_matches(self, out_stream, out_format):
+        if out_format != "bed":
+            separator = "," if out_format == "csv" else "\t"
+            columns = ["record", "position", "end", "enzyme", "strand"]
+            if self.max_mismatches:
+                columns.append("mismatches")
+            out_stream.write(separator.join(columns) + "\n")
+        lines = []
+        for line in self.format_rows(self.all_rows(), out_format):
+            lines.append(line)
+            if len(lines) >= WRITE_BATCH_SIZE:
+                out_stream.write(''.join(lines))
+                lines = []
+        out_stream.write(''.join(lines))
+
+    def display_matches(self):
+        """Displays the matches on the screen, all the enzymes matching at the same position are shown together"""
+        current_site = None
+        re_list = []
+        for record_id, position, enzyme_id, strand, mismatches in self.all_rows():
+            if (record_id, position) != current_site:
+                if re_list:
+                    self.display_site(current_site, re_list)
+                current_site = (record_id, position)
+                re_list = []
+            # Sites on the minus strand are shown with the same tag print_tree() uses for them, and near-sites
+            # with the number of mismatches
+            name = self.enzyme_names[enzyme_id] + (Nucleotides.REVERSE_STRAND_TAG if strand < 0 else "")
+            if mismatches:
+                name += f" ({mismatches} mismatch{'es' if mismatches > 1 else ''})"
+            re_list.append(name)
+        if re_list:
+            self.display_site(current_site, re_list)
+
+    def display_site(self, site, re_list):
+        record_id, position = site
+        record = self.record_names[record_id]
+        if record:
+            print(f"found match at {position} in {record} for {re_list}")
+        else:
+            print(f"found match at {position} for {re_list}")
+
     def print_matches(self):
         """Function to output the matches to the file specified"""
-        if self.out_file is not None:
-            print(f"Printing results to file: {self.out_file}")     # DEBUG
+        if self.out_file is not None and self.out_file != "screen":
+            print(f"Printing {self.match_count} results to file: {self.out_file}")
+            try:
+                with open(self.out_file, "w", buffering=1024 * 1024) as out_stream:
+                    self.write_matches(out_stream, self.get_out_format())
+            except Exception as err:
+                print(f"\nERROR - Result_Manager.print_matches() had a problem with the file: {self.out_file}."
+                      f"\nError was: ", err)
         else:
-            print(f"Printing results to screen")        # DEBUG
+            print(f"Printing {self.match_count} results to screen")
+            self.display_matches()
+        self.remove_spill_files()
@@ -0,0 +1,152 @@
+#############################################################################
+#
+#   Usage:      Used by all the modules, shown with -stats and -profile
+#
+#   This File:  Timers and counters for each phase of a run, the optional
+#               cProfile and tracemalloc hooks and the progress display
+#
+#############################################################################
+
+# Import standard modules
+import sys
+import json
+import time
+import io
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Profilers that can be turned on with -profile=name
+PROFILERS = ["cprofile", "tracemalloc"]
+# Number of lines of profiler output included in the summary
+PROFILE_LINES = 25
+# Least number of seconds between progress updates on the screen
+PROGRESS_INTERVAL = 0.5
+
+
+class Run_Stats():
+    """Collects the time spent in each phase and counters such as nodes created, nodes visited, matches emitted and
+    bytes read. The search engines only add to the counters once per chunk or enzyme so the cost is small"""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        # The shards of a parallel search are read on another thread, which adds to the same counters
+        self.lock = threading.Lock()
+        self.profiler_name = None
+        self.profiler = None
+        self.profile_summary = None
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def add(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def merge_counters(self, counters):
+        """Adds the counters sent back from a worker process"""
+        for counter, amount in counters.items():
+            self.add(counter, amount)
+
+    def start_profiler(self, profiler_name):
+        self.profiler_name = profiler_name
+        if profiler_name == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profiler_name == "tracemalloc":
+            tracemalloc.start()
+
+    def stop_profiler(self):
+        if self.profiler_name == "cprofile" and self.profiler:
+            self.profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self.profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+            self.profile_summary = output.getvalue().splitlines()
+        elif self.profiler_name == "tracemalloc" and tracemalloc.is_tracing():
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            top_lines = [str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_LINES]]
+            self.profile_summary = {"current_bytes": current_bytes, "peak_bytes": peak_bytes, "top": top_lines}
+        self.profiler = None
+
+    def get_summary(self):
+        """Everything collected so far as a dictionary that can be saved as JSON"""
+        summary = {"timers": {phase: round(seconds, 6) for phase, seconds in self.timers.items()},
+                   "counters": dict(self.counters)}
+        bases = self.counters.get("bases_scanned", 0)
+        if bases:
+            summary["nodes_visited_per_base"] = round(self.counters.get("nodes_visited", 0) / bases, 4)
+            scan_seconds = self.timers.get("scan", 0)
+            if scan_seconds:
+                summary["bases_per_second"] = round(bases / scan_seconds)
+        if self.profile_summary is not None:
+            summary["profile"] = {"profiler": self.profiler_name, "result": self.profile_summary}
+        return summary
+
+    def write_summary(self, filename):
+        """Saves the summary to the file, or shows it on the screen if the filename is empty"""
+        summary = json.dumps(self.get_summary(), indent=4)
+        if not filename:
+            print(summary)
+            return
+        try:
+            with open(filename, "w") as stats_file:
+                stats_file.write(summary + "\n")
+        except Exception as err:
+            print(f"\nERROR - RunStats.write_summary() had a problem with the file: {filename}.\nError was: ", err)
+
+
+class Progress():
+    """Shows how far through a task we are on a single line, but no more often than every PROGRESS_INTERVAL seconds
+    however often update() is called"""
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.last_update = time.monotonic()
+        self.shown = False
+        self.last_shown = None
+
+    def update(self, done):
+        now = time.monotonic()
+        if now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        self.show(done)
+
+    def show(self, done):
+        pct_complete = (done / self.total) * 100 if self.total else 100
+        if f"{pct_complete:.0f}" == self.last_shown:
+            return
+        self.last_shown = f"{pct_complete:.0f}"
+        sys.stdout.write(f"\r{self.label}: {pct_complete:.0f}% completed")  # Prints on the same line
+        sys.stdout.flush()
+        self.shown = True
+
+    def finish(self):
+        # Only finish the line if something was shown, short tasks don't print anything
+        if self.shown:
+            self.show(self.total)
+            sys.stdout.write("\n")
+
+
+# Shared by all the modules for the current run
+stats = Run_Stats()
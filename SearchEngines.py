@@ -0,0 +1,36 @@
+#############################################################################
+#
+#   Usage:      Used by Regulon.py, RegulonServer.py and Benchmark.py
+#
+#   This File:  Creates the search engine chosen by name, all of them
+#               support build_tree(), find_matches() and scan_sequence()
+#
+#############################################################################
+
+import SeqTree
+import MaskMatcher
+import CompactSeqTree
+import NumpyScan
+
+# the search engines that can be chosen by name
+ENGINE_NAMES = ["trie", "mask", "compact", "numpy"]
+
+
+def create_engine(engine_name, use_automaton=False, cache=None, both_strands=False, max_mismatches=0):
+    """Returns an empty search engine, or None if the name isn't recognised or the engine can't be used here.
+    use_automaton only applies to the trie and cache only applies to the compact tree. With both_strands the
+    engine also finds the sites on the minus strand, and with max_mismatches it also finds the near-sites that
+    differ from a sequence in up to that many positions"""
+    if engine_name == "trie":
+        return SeqTree.RESeqTree(use_automaton=use_automaton, both_strands=both_strands,
+                                 max_mismatches=max_mismatches)
+    if engine_name == "mask":
+        return MaskMatcher.REMaskMatcher(both_strands=both_strands, max_mismatches=max_mismatches)
+    if engine_name == "compact":
+        return CompactSeqTree.RECompactTree(cache=cache, both_strands=both_strands, max_mismatches=max_mismatches)
+    if engine_name == "numpy":
+        if NumpyScan.numpy is None:
+            print("The numpy engine needs NumPy, install it with: pip install numpy")
+            return None
+        return NumpyScan.RENumpyMatcher(both_strands=both_strands, max_mismatches=max_mismatches)
+    return None
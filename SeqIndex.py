@@ -0,0 +1,387 @@
+#############################################################################
+#
+#   Usage:      Used by main script Regulon.py with -index
+#
+#   This File:  Persistent k-mer index of a DNA sequence, built once and
+#               kept on disk, so the same sequence can be searched for many
+#               different enzyme panels by looking up the positions of each
+#               recognition sequence rather than scanning it again. Patterns
+#               that would need too many lookups, or match too much of the
+#               sequence, are still found by scanning
+#
+#############################################################################
+
+# Import standard modules
+import os
+import re
+import mmap
+import json
+import array
+import bisect
+import heapq
+import struct
+import itertools
+# import utility module to handle reading the source files
+import FileHandler
+import Nucleotides
+import SeqStore
+import SeqTree
+import RunStats
+
+# Identifies an index file and the layout of its header
+INDEX_MAGIC = b"RGKX"
+INDEX_FORMAT_VERSION = 1
+# magic, format version, k, position type code, number of buckets + 1, number of positions, bytes of json metadata.
+# This comes to 40 bytes so the arrays that follow start on an 8 byte boundary
+HEADER_FORMAT = "<4sIIIQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_EXTENSION = ".kidx"
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".regulon_index")
+# Number of nucleotides in each k-mer, the index has 4 ** k buckets
+DEFAULT_KMER_LENGTH = 8
+# Largest index that will be built, counting the file and the 2 arrays of bucket counts held while it is built
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# A pattern whose ambiguity codes expand to more combinations of nucleotides than this, not counting any N's at the
+# end of its k-mer, is scanned for instead
+DEFAULT_MAX_LOOKUPS = 256
+# Each candidate has to be decoded and checked, which costs far more than scanning a nucleotide, so a pattern is
+# scanned for when its candidates come to more than this share of the sequence
+MAX_CANDIDATE_SHARE = 0.02
+
+
+class Seq_Index():
+    """Every position of the sequence store that starts with one of the 4 nucleotides, sorted by the k nucleotides
+    starting there. The positions count through all the records one after the other. Near the end of a run of
+    nucleotides there are fewer than k left, those positions are filed as if the rest were A. Any candidate found
+    in the index is checked against the sequence, so that never causes a false match"""
+
+    def __init__(self, store_filename, index_filename):
+        self.seq_store = SeqStore.Seq_Store(store_filename)
+        try:
+            with open(index_filename, "rb") as index_file:
+                self.index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            self.seq_store.close()
+            raise
+        try:
+            self.map_arrays(index_filename)
+        except Exception:
+            # The views of the arrays hold the map open, so they have to go first
+            for view_name in ("offsets", "positions", "index_view"):
+                if hasattr(self, view_name):
+                    getattr(self, view_name).release()
+            self.index_map.close()
+            self.seq_store.close()
+            raise
+
+    def map_arrays(self, index_filename):
+        """Checks the header of the mapped index file and makes views of its arrays"""
+        header = struct.unpack_from(HEADER_FORMAT, self.index_map, 0)
+        magic, format_version, self.k, type_code, offsets_len, positions_len, meta_len = header
+        item_size = array.array(chr(type_code)).itemsize
+        if (magic != INDEX_MAGIC or format_version != INDEX_FORMAT_VERSION
+                or len(self.index_map) != HEADER_SIZE + (offsets_len + positions_len) * item_size + meta_len):
+            raise ValueError(f"{index_filename} isn't an index this version can read")
+
+        # The arrays are used straight from the mapped file so only the buckets that are looked up get read
+        view = self.index_view = memoryview(self.index_map)
+        start = HEADER_SIZE
+        self.offsets = view[start:start + offsets_len * item_size].cast(chr(type_code))
+        start += offsets_len * item_size
+        self.positions = view[start:start + positions_len * item_size].cast(chr(type_code))
+        start += positions_len * item_size
+        metadata = json.loads(bytes(view[start:start + meta_len]).decode("utf-8"))
+        self.record_names = metadata["record_names"]
+        self.record_starts = metadata["record_starts"]
+        self.total_length = metadata["total_length"]
+
+    def close(self):
+        self.offsets.release()
+        self.positions.release()
+        self.index_view.release()
+        self.index_map.close()
+        self.seq_store.close()
+
+    def plan_pattern(self, sequence, max_lookups=DEFAULT_MAX_LOOKUPS):
+        """Returns the bucket ranges to look up for the pattern, as (offset of the k-mer in the pattern, list of
+        (first bucket, bucket after the last)), with the one giving fewest candidates first. Up to 2 k-mers that
+        don't overlap are returned so their candidates can be intersected. Returns None if the pattern should be
+        scanned for instead"""
+        k = self.k
+        if len(sequence) < k:
+            # Every k-mer starting with the pattern is in one range of buckets
+            windows = [(0, sequence)]
+        else:
+            windows = [(offset, sequence[offset:offset + k]) for offset in range(len(sequence) - k + 1)]
+        plans = []
+        for offset, window in windows:
+            ranges = self.bucket_ranges(window, max_lookups)
+            if ranges is not None:
+                candidates = sum(self.offsets[last] - self.offsets[first] for first, last in ranges)
+                plans.append((candidates, offset, ranges))
+        if not plans:
+            return None
+        plans.sort(key=lambda plan: plan[0])
+        if plans[0][0] > self.total_length * MAX_CANDIDATE_SHARE:
+            return None
+        chosen = [plans[0]]
+        for plan in plans[1:]:
+            if abs(plan[1] - chosen[0][1]) >= k:
+                chosen.append(plan)
+                break
+        return [(offset, ranges) for candidates, offset, ranges in chosen]
+
+    def bucket_ranges(self, window, max_lookups):
+        """Expands the ambiguity codes of up to k nucleotides into the ranges of buckets they match, joining ranges
+        that follow on from each other. Returns None if there are more than max_lookups combinations of nucleotides"""
+        # An N at the end only widens the ranges, so it is left out of the expansion
+        window = window.rstrip("NX")
+        fan_out = 1
+        for code in window:
+            fan_out *= len(Nucleotides.IUPAC_CODES[code])
+        if fan_out > max_lookups:
+            return None
+        bucket_span = 4 ** (self.k - len(window))
+        ranges = []
+        for bases in sorted(itertools.product(*(Nucleotides.IUPAC_CODES[code] for code in window))):
+            first = int(''.join(bases).translate(SeqStore.PACK_BASES) or "0", 4) * bucket_span
+            if ranges and ranges[-1][1] == first:
+                ranges[-1][1] = first + bucket_span
+            else:
+                ranges.append([first, first + bucket_span])
+        return ranges
+
+    def lookup(self, offset, ranges):
+        """Yields in order the positions where the pattern would start if its k-mer at offset is in the ranges. The
+        positions in each bucket are already in order, so the buckets are merged as they are read rather than
+        collected and sorted"""
+        buckets = []
+        for first, last in ranges:
+            RunStats.stats.add("index_lookups")
+            for bucket in range(first, last):
+                if self.offsets[bucket] != self.offsets[bucket + 1]:
+                    buckets.append(self.positions[self.offsets[bucket]:self.offsets[bucket + 1]])
+        for position in heapq.merge(*buckets):
+            yield position - offset
+
+    def find_pattern(self, sequence, plan, pattern_regex):
+        """Yields (record, position in the record counting from 0) in order for each place the pattern is found"""
+        offset, ranges = plan[0]
+        starts = self.lookup(offset, ranges)
+        for offset, ranges in plan[1:]:
+            starts = intersect_sorted(starts, self.lookup(offset, ranges))
+        candidate_count = 0
+        for start in starts:
+            candidate_count += 1
+            record_index = bisect.bisect_right(self.record_starts, start) - 1
+            if record_index < 0:
+                continue
+            record_position = start - self.record_starts[record_index]
+            record_name = self.record_names[record_index]
+            candidate = self.seq_store.get_sequence(record_name, record_position, record_position + len(sequence))
+            if pattern_regex.fullmatch(candidate):
+                yield record_name, record_position
+        RunStats.stats.add("index_candidates", candidate_count)
+
+
+def intersect_sorted(first_positions, second_positions):
+    """Yields the positions found in both of 2 iterators of positions in increasing order"""
+    second = next(second_positions, None)
+    for first in first_positions:
+        while second is not None and second < first:
+            second = next(second_positions, None)
+        if second is None:
+            return
+        if second == first:
+            yield first
+
+
+def pattern_to_regex(sequence):
+    """The recognition sequence as a regular expression matching only the 4 nucleotides, the same as the engines"""
+    return re.compile(''.join(f"[{Nucleotides.IUPAC_CODES[code]}]" for code in sequence))
+
+
+def get_index_paths(seq_filename, index_dir, k):
+    """Returns the store to search and the index file to use for the sequence file, both named after its MD5. A
+    FASTA file is converted to a store in the index folder so candidates can be checked without reading it again"""
+    checksum = FileHandler.file_checksum(seq_filename)
+    if not checksum:
+        return None, None
+    store_filename = seq_filename
+    if not SeqStore.is_seq_store(seq_filename):
+        store_filename = os.path.join(index_dir,
+                                      f"{checksum}-v{SeqStore.STORE_FORMAT_VERSION}{SeqStore.STORE_EXTENSION}")
+    return store_filename, os.path.join(index_dir, f"{checksum}-k{k}{INDEX_EXTENSION}")
+
+
+def index_size(seq_store, k):
+    """Returns the most bytes building the index could take, counting the 2 arrays of bucket counts held in memory.
+    Only the store's index is needed for this, not the sequence"""
+    positions = sum(record["length"] - seq_store.unknown_bases(record) for record in seq_store.records)
+    type_code = "I" if seq_store.total_length() < 2 ** 32 else "Q"
+    item_size = array.array(type_code).itemsize
+    return HEADER_SIZE + (4 ** k + 1 + positions) * item_size + 2 * 4 ** k * item_size, type_code
+
+
+def build_index(store_filename, index_filename, k=DEFAULT_KMER_LENGTH, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE):
+    """Writes the index of the store in 2 passes, the first counts the k-mers in each bucket and the second files
+    each position straight into the memory mapped index file, so only the bucket counts are held in memory"""
+    seq_store = SeqStore.Seq_Store(store_filename)
+    type_code = index_size(seq_store, k)[1]
+    item_size = array.array(type_code).itemsize
+    record_names = [record["name"] for record in seq_store.records]
+    record_starts = list(itertools.accumulate([0] + [record["length"] for record in seq_store.records[:-1]]))
+
+    counts = array.array(type_code, bytes(4 ** k * item_size))
+    with RunStats.stats.timer("index_count"):
+        for record_start, kmer_codes in stream_kmer_codes(seq_store, k, chunk_size):
+            for code in kmer_codes:
+                counts[code] += 1
+    offsets = array.array(type_code, [0])
+    offsets.extend(itertools.accumulate(counts))
+    del counts
+    positions_len = offsets[-1]
+
+    metadata = json.dumps({"record_names": record_names, "record_starts": record_starts,
+                           "total_length": seq_store.total_length(), "store": os.path.abspath(store_filename)})
+    metadata = metadata.encode("utf-8")
+    positions_start = HEADER_SIZE + len(offsets) * item_size
+    temp_path = f"{index_filename}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(index_filename) or ".", exist_ok=True)
+        with open(temp_path, "wb+") as index_file:
+            index_file.truncate(positions_start + positions_len * item_size + len(metadata))
+            index_map = mmap.mmap(index_file.fileno(), 0)
+            struct.pack_into(HEADER_FORMAT, index_map, 0, INDEX_MAGIC, INDEX_FORMAT_VERSION, k, ord(type_code),
+                             len(offsets), positions_len, len(metadata))
+            index_map[HEADER_SIZE:positions_start] = offsets.tobytes()
+            index_map[positions_start + positions_len * item_size:] = metadata
+            positions = memoryview(index_map)[positions_start:positions_start + positions_len * item_size]
+            positions = positions.cast(type_code)
+            # The next free slot in each bucket, positions are filed in order so each bucket ends up sorted
+            next_slots = offsets[:-1]
+            del offsets
+            with RunStats.stats.timer("index_fill"):
+                for start, kmer_codes in stream_kmer_codes(seq_store, k, chunk_size, record_starts):
+                    for position, code in enumerate(kmer_codes, start):
+                        if code >= 0:
+                            positions[next_slots[code]] = position
+                            next_slots[code] += 1
+            positions.release()
+            index_map.close()
+        os.replace(temp_path, index_filename)
+    except Exception as err:
+        print(f"\nERROR - SeqIndex.build_index() had a problem with the file: {index_filename}.\nError was: ", err)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    finally:
+        seq_store.close()
+    RunStats.stats.add("index_positions", positions_len)
+    return True
+
+
+def stream_kmer_codes(seq_store, k, chunk_size, record_starts=None):
+    """Yields (position of the first nucleotide, k-mer codes) a chunk at a time for every record of the store. When
+    record_starts is given the positions count through all the records and a position that doesn't start with a
+    nucleotide gets the code -1, otherwise those positions are left out"""
+    for record_index, record in enumerate(seq_store.records):
+        record_start = record_starts[record_index] if record_starts is not None else 0
+        for chunk_start in range(0, record["length"], chunk_size):
+            # Read k - 1 more so the k-mers starting at the end of the chunk are complete
+            chunk = seq_store.get_sequence(record["name"], chunk_start, chunk_start + chunk_size + k - 1)
+            digits = chunk.translate(SeqStore.PACK_BASES)
+            last = min(chunk_size, len(chunk))
+            codes = []
+            for run in re.finditer("[0-3]+", digits[:last + k - 1]):
+                run_start = run.start()
+                if run_start >= last:
+                    break
+                if record_starts is not None:
+                    codes.extend([-1] * (run_start - len(codes)))
+                # Pad with A (0) so the last k - 1 positions of the run get a code as well
+                run_digits = run.group() + "0" * (k - 1)
+                run_end = min(run.end(), last)
+                codes.extend(int(run_digits[position:position + k], 4) for position in range(run_end - run_start))
+            if record_starts is not None:
+                codes.extend([-1] * (last - len(codes)))
+            yield record_start + chunk_start, codes
+
+
+def open_index(seq_filename, index_dir=DEFAULT_INDEX_DIR, k=DEFAULT_KMER_LENGTH, max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the index of the sequence file, building it the first time. Returns None if it would take more than
+    max_bytes or can't be built, in which case the sequence has to be scanned"""
+    store_filename, index_filename = get_index_paths(seq_filename, index_dir, k)
+    if index_filename is None:
+        return None
+    # An index left from before the store format changed has no store of the current version, so it is rebuilt
+    # along with the store
+    converted = False
+    if store_filename != seq_filename and not os.path.exists(store_filename):
+        os.makedirs(index_dir, exist_ok=True)
+        print(f"Converting {seq_filename} to a sequence store")
+        with RunStats.stats.timer("index_convert"):
+            if not SeqStore.convert_fasta(seq_filename, store_filename):
+                return None
+        converted = True
+    if converted or not os.path.exists(index_filename):
+        seq_store = SeqStore.Seq_Store(store_filename)
+        needed_bytes, type_code = index_size(seq_store, k)
+        seq_store.close()
+        if needed_bytes > max_bytes:
+            print(f"The index of {seq_filename} would need {needed_bytes} bytes, more than the {max_bytes} allowed,"
+                  f" so it will be scanned instead")
+            return None
+        print(f"Building the {k}-mer index of {seq_filename}")
+        if not build_index(store_filename, index_filename, k):
+            return None
+    try:
+        return Seq_Index(store_filename, index_filename)
+    except Exception as err:
+        print(f"\nERROR - SeqIndex.open_index() had a problem with the file: {index_filename}.\nError was: ", err)
+        return None
+
+
+def find_matches_indexed(engine, seq_filename, result_manager, index_dir=DEFAULT_INDEX_DIR, k=DEFAULT_KMER_LENGTH,
+                         max_bytes=DEFAULT_MAX_BYTES, max_lookups=DEFAULT_MAX_LOOKUPS,
+                         chunk_size=FileHandler.DEFAULT_CHUNK_SIZE):
+    """Same as engine.find_matches() but the recognition sequences are looked up in the index of the sequence
+    file. The ones the planner turns down are put in an automaton of their own and found with one scan of the
+    sequence. Like the automaton, every site is reported even when one recognition sequence starts with another.
+    Near-sites aren't in the index, so with max_mismatches the whole search is a scan"""
+    seq_index = None if engine.max_mismatches else open_index(seq_filename, index_dir, k, max_bytes)
+    if seq_index is None:
+        engine.find_matches(seq_filename, result_manager, chunk_size)
+        return
+
+    # Register the records in file order so the matches are output in the same order as a scan
+    for record_name, record in zip(seq_index.record_names, seq_index.seq_store.records):
+        result_manager.get_record_id(record_name)
+        result_manager.set_record_length(record_name, record["length"])
+
+    scan_tree = SeqTree.RESeqTree(use_automaton=True)
+    scan_count = 0
+    site_count = 0
+    sequences = Nucleotides.strand_sequences(engine.re_seq_dict, engine.both_strands)
+    with RunStats.stats.timer("index_search"):
+        for entry, sequence in sequences:
+            plan = seq_index.plan_pattern(sequence, max_lookups)
+            if plan is None:
+                # Only this strand of the enzyme is scanned for, the other one may still be looked up in the index
+                scan_tree.add_sequence(entry, sequence)
+                scan_count += 1
+                continue
+            # Each site goes straight to the results manager, which sorts them and spills them to disk when needed
+            for record_name, position in seq_index.find_pattern(sequence, plan, pattern_to_regex(sequence)):
+                Nucleotides.report_strands(result_manager, position + 1, [entry], record_name)
+                site_count += 1
+    RunStats.stats.add("patterns_indexed", len(sequences) - scan_count)
+    RunStats.stats.add("patterns_scanned", scan_count)
+    print(f"Found {site_count} sites using the index of {seq_filename}, {scan_count} sequences left to scan for")
+
+    if scan_count:
+        scan_tree.find_matches(seq_index.seq_store.filename, result_manager, chunk_size)
+    seq_index.close()
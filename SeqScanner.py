@@ -0,0 +1,119 @@
+#############################################################################
+#
+#   Usage:      Used by the search engines in SeqTree.py, MaskMatcher.py,
+#               CompactSeqTree.py and NumpyScan.py
+#
+#   This File:  Feeds the DNA sequence from seq_file=filename to a search
+#               engine a chunk at a time so genome sized files can be
+#               searched in a bounded amount of memory
+#
+#############################################################################
+
+# Import standard modules
+import os
+import time
+# import utility module to handle reading the source files
+import FileHandler
+import SeqStore
+import RunStats
+
+
+def scan_file(engine, filename, result_manager, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, seq_lines=None,
+              region=None):
+    """Calls engine.scan_sequence() for each chunk of each record in the file. Consecutive chunks overlap by one
+    less than the longest reference sequence, the engine only reports matches that end after the overlap so
+    nothing is reported twice. If the text of the file has already been read it can be passed in as seq_lines.
+    The region is record:start-end to only search part of one record"""
+    print(f"Longest reference sequence is {engine.get_tree_depth()} nucleotides long")
+    overlap = max(engine.get_tree_depth() - 1, 0)
+    dna_seq_length = 0
+    windows, read_size = get_windows(filename, overlap, chunk_size, region, seq_lines)
+    progress = RunStats.Progress(f"Searching {filename}", read_size)
+    bytes_read_before = RunStats.stats.counters.get("bytes_read", 0)
+    while True:
+        # Time reading the file separately from searching it
+        start = time.perf_counter()
+        window_details = next(windows, None)
+        RunStats.stats.add_time("read_sequence", time.perf_counter() - start)
+        if window_details is None:
+            break
+        record_name, window_offset, window, window_overlap = window_details
+        with RunStats.stats.timer("scan"):
+            engine.scan_sequence(window, result_manager, record_name, window_offset, window_overlap)
+        RunStats.stats.add("bases_scanned", len(window) - window_overlap)
+        result_manager.set_record_length(record_name, window_offset + len(window))
+        dna_seq_length += len(window) - window_overlap
+        progress.update(RunStats.stats.counters.get("bytes_read", 0) - bytes_read_before)
+    progress.finish()
+    print(f"DNA sequence is {dna_seq_length} nucleotides long")
+    return dna_seq_length
+
+
+def get_windows(filename, overlap, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, region=None, seq_lines=None):
+    """Returns a generator of (record name, position of the window in the record, window, number of overlap
+    nucleotides) for a FASTA file or a packed store from SeqStore.py, and the number of bytes it will read.
+    A store only decodes the bytes of the region, a FASTA file has to be read up to the end of it"""
+    try:
+        if region is not None and not isinstance(region, tuple):
+            region = SeqStore.parse_region(region)
+        if seq_lines is None and SeqStore.is_seq_store(filename):
+            seq_store = SeqStore.Seq_Store(filename)
+            if region is not None:
+                record_name, start, end = region
+                try:
+                    record_length = seq_store.get_record(record_name)["length"]
+                except ValueError:
+                    seq_store.close()
+                    raise
+                read_size = ((record_length if end is None else min(end, record_length)) - start) // 4
+            else:
+                read_size = seq_store.total_length() // 4
+            return store_windows(seq_store, overlap, chunk_size, region), read_size
+    except ValueError as err:
+        print(f"\nERROR - SeqScanner.get_windows() had a problem with the file: {filename}.\nError was: ", err)
+        return iter(()), 0
+    windows = FileHandler.stream_seq_windows(filename, overlap, chunk_size, seq_lines)
+    if region is not None:
+        windows = clip_windows(windows, region, filename)
+    return windows, get_file_size(filename)
+
+
+def store_windows(seq_store, overlap, chunk_size, region):
+    """Streams the windows of the store and closes it once they have all been searched"""
+    try:
+        yield from seq_store.stream_windows(overlap, chunk_size, region)
+    finally:
+        seq_store.close()
+
+
+def clip_windows(windows, region, filename):
+    """Cuts the windows read from a FASTA file down to the region. The overlap of a clipped window only counts the
+    nucleotides of the region that were in the previous window, so a site at the start of the region is found.
+    Reading stops at the end of the region, and an error is shown if the file has no such record"""
+    record_name, start, end = region
+    record_found = False
+    for window_record, window_offset, window, window_overlap in windows:
+        if window_record != record_name:
+            if record_found:
+                break
+            continue
+        record_found = True
+        if end is not None and window_offset >= end:
+            break
+        clip_start = max(start, window_offset)
+        clip_end = window_offset + len(window) if end is None else min(end, window_offset + len(window))
+        if clip_start >= clip_end:
+            continue
+        scanned_end = min(window_offset + window_overlap, clip_end)
+        yield (window_record, clip_start, window[clip_start - window_offset:clip_end - window_offset],
+               max(scanned_end - clip_start, 0))
+    if not record_found:
+        print(f"\nERROR - SeqScanner.clip_windows() had a problem with the file: {filename}.\nError was: ",
+              f"it has no record called {record_name}")
+
+
+def get_file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
@@ -0,0 +1,291 @@
+#############################################################################
+#
+#   Usage:      SeqStore fasta_file=filename store_file=filename
+#               Stores are read by SeqScanner.py when used as seq_file
+#
+#   This File:  Converts a FASTA file to a packed 2 bit store, 4 nucleotides
+#               to a byte, with the runs of lower case (soft masked) bases
+#               and of any other character kept to one side and an index of
+#               where each record starts. The store is memory mapped so a
+#               region of one record can be searched without reading the
+#               rest of the file
+#
+#############################################################################
+
+# Import standard modules
+import os
+import re
+import sys
+import mmap
+import json
+import array
+import struct
+import bisect
+# import utility module to handle reading the source files
+import FileHandler
+import RunStats
+
+# Identifies a store file and the layout of its header
+STORE_MAGIC = b"RG2B"
+STORE_FORMAT_VERSION = 2
+# magic, format version, number of records, position and bytes of the json index at the end of the file
+HEADER_FORMAT = "<4sIIQQ"
+# The runs of each record are 2 arrays of this type, the starts and then the ends, after its packed nucleotides
+RUN_TYPE = "q"
+RUN_ITEM_SIZE = array.array(RUN_TYPE).itemsize
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+STORE_EXTENSION = ".2bit"
+
+# A is 0, C is 1, G is 2 and T is 3, the first nucleotide of a byte is in the top 2 bits
+PACK_BASES = str.maketrans("ACGT", "0123")
+# Each hex digit of a packed byte is 2 nucleotides, so a region decodes with bytes.hex() and one translate()
+HEX_TO_BASES = {ord(f"{value:x}"): "ACGT"[value >> 2] + "ACGT"[value & 3] for value in range(16)}
+# Lower case bases are packed in upper case and kept in the mask runs so they are read back in lower case, then
+# anything that isn't one of the 4 nucleotides is kept in the N runs and read back as N
+LOWER_CASE = re.compile("[a-z]+")
+OTHER_CHARACTERS = re.compile("[^ACGT]+")
+UNKNOWN_BASE = "N"
+
+
+def convert_fasta(fasta_filename, store_filename, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE):
+    """Writes the sequence of every record in the FASTA file to a store. Returns the number of records written"""
+    records = []
+    temp_path = f"{store_filename}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as store_file:
+            # The header is written again at the end once the position of the index is known
+            store_file.write(bytes(HEADER_SIZE))
+            record = None
+            remainder = ""
+            for record_name, record_offset, chunk in FileHandler.stream_seq_file(fasta_filename, chunk_size):
+                if record is None or record_offset == 0:
+                    if record is not None:
+                        write_record_end(store_file, record, remainder, n_runs, mask_runs)
+                    # Each record starts on a byte boundary so it can be read without its neighbours
+                    record = {"name": record_name, "length": 0, "offset": store_file.tell()}
+                    records.append(record)
+                    remainder = ""
+                    n_runs = (array.array(RUN_TYPE), array.array(RUN_TYPE))
+                    mask_runs = (array.array(RUN_TYPE), array.array(RUN_TYPE))
+                add_runs(mask_runs, LOWER_CASE, chunk, record_offset)
+                chunk = chunk.upper()
+                add_runs(n_runs, OTHER_CHARACTERS, chunk, record_offset)
+                record["length"] = record_offset + len(chunk)
+                chunk = remainder + OTHER_CHARACTERS.sub(lambda run: "A" * len(run.group()), chunk)
+                packed_length = len(chunk) - len(chunk) % 4
+                store_file.write(pack_bases(chunk[:packed_length]))
+                remainder = chunk[packed_length:]
+            if record is not None:
+                write_record_end(store_file, record, remainder, n_runs, mask_runs)
+            index = json.dumps({"byte_order": sys.byteorder, "records": records}).encode("utf-8")
+            index_offset = store_file.tell()
+            store_file.write(index)
+            store_file.seek(0)
+            store_file.write(struct.pack(HEADER_FORMAT, STORE_MAGIC, STORE_FORMAT_VERSION, len(records),
+                                         index_offset, len(index)))
+        os.replace(temp_path, store_filename)
+    except Exception as err:
+        print(f"\nERROR - SeqStore.convert_fasta() had a problem with the file: {store_filename}.\nError was: ", err)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return 0
+    return len(records)
+
+
+def write_record_end(store_file, record, remainder, n_runs, mask_runs):
+    """Writes the last few nucleotides of a record followed by its runs, and adds where the runs are to its entry
+    in the index. The runs start on an 8 byte boundary so they can be used straight from the memory map"""
+    store_file.write(pack_bases(remainder, True))
+    store_file.write(bytes(-store_file.tell() % RUN_ITEM_SIZE))
+    for name, (starts, ends) in (("n_runs", n_runs), ("mask_runs", mask_runs)):
+        record[name] = [store_file.tell(), len(starts)]
+        store_file.write(starts.tobytes())
+        store_file.write(ends.tobytes())
+
+
+def pack_bases(bases, pad=False):
+    """Packs a string of A, C, G and T into bytes. Its length has to be a multiple of 4 unless pad is set, in which
+    case the last byte is filled out with A"""
+    if pad and len(bases) % 4:
+        bases += "A" * (4 - len(bases) % 4)
+    if not bases:
+        return b""
+    return int(bases.translate(PACK_BASES), 4).to_bytes(len(bases) // 4, "big")
+
+
+def add_runs(runs, pattern, chunk, chunk_offset):
+    """Adds the start and end of each run of the pattern in the chunk to the (starts, ends) arrays for its record,
+    joining a run onto the last one if it carries on from the end of the previous chunk"""
+    starts, ends = runs
+    for run in pattern.finditer(chunk):
+        if ends and ends[-1] == chunk_offset + run.start():
+            ends[-1] = chunk_offset + run.end()
+        else:
+            starts.append(chunk_offset + run.start())
+            ends.append(chunk_offset + run.end())
+
+
+def overlay_runs(bases, start, end, runs, replace):
+    """Returns the bases from start to end with replace() applied to the parts covered by the runs. Only the runs
+    that reach the region are looked at, the first is found with bisect"""
+    starts, ends = runs
+    run_index = bisect.bisect_right(ends, start)
+    if run_index == len(starts) or starts[run_index] >= end:
+        return bases
+    pieces = []
+    position = start
+    while run_index < len(starts) and starts[run_index] < end:
+        run_start = max(starts[run_index], start)
+        run_end = min(ends[run_index], end)
+        pieces.append(bases[position - start:run_start - start])
+        pieces.append(replace(bases[run_start - start:run_end - start]))
+        position = run_end
+        run_index += 1
+    pieces.append(bases[position - start:])
+    return ''.join(pieces)
+
+
+def is_seq_store(filename):
+    try:
+        with open(filename, "rb") as store_file:
+            return store_file.read(len(STORE_MAGIC)) == STORE_MAGIC
+    except OSError:
+        return False
+
+
+def parse_region(region):
+    """Turns record:start-end, with positions counting from 1 and including both ends, into (record, start, end)
+    with start counting from 0 and end excluded. Just the record name means the whole record. Raises ValueError
+    if the part after the last colon isn't start-end"""
+    record_name, _, span = region.rpartition(":")
+    if not record_name:
+        return region, 0, None
+    positions = span.replace(",", "").split("-")
+    if len(positions) != 2 or not all(position.isdigit() for position in positions):
+        raise ValueError(f"region {region} should be record:start-end")
+    start, end = (int(position) for position in positions)
+    if start < 1 or end < start:
+        raise ValueError(f"region {region} doesn't have a valid start and end")
+    return record_name, start - 1, end
+
+
+class Seq_Store():
+    """Read only view of a store file. Only the header and index are read when it is opened, the packed nucleotides
+    and the runs of each record are left to the memory map and decoded a region at a time"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as store_file:
+            self.store_map = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, record_count, index_offset, index_len = struct.unpack_from(HEADER_FORMAT,
+                                                                                          self.store_map, 0)
+        if magic != STORE_MAGIC or format_version != STORE_FORMAT_VERSION:
+            self.store_map.close()
+            raise ValueError(f"{filename} isn't a sequence store this version can read")
+        index = json.loads(self.store_map[index_offset:index_offset + index_len].decode("utf-8"))
+        self.records = index["records"]
+        self.record_index = {record["name"]: record for record in self.records}
+        # Written on a machine with the other byte order, so the runs have to be copied and swapped
+        self.swap_bytes = index["byte_order"] != sys.byteorder
+        # (starts, ends) of the runs of each record, keyed by record name and kind of run, made when first needed
+        self.runs = {}
+        self.run_views = []
+
+    def close(self):
+        for view in self.run_views:
+            view.release()
+        self.run_views = []
+        self.runs = {}
+        self.store_map.close()
+
+    def get_runs(self, record, kind):
+        """Returns (starts, ends) of the "n_runs" or "mask_runs" of the record"""
+        runs = self.runs.get((record["name"], kind))
+        if runs is None:
+            offset, count = record[kind]
+            runs = []
+            for start in (offset, offset + count * RUN_ITEM_SIZE):
+                if self.swap_bytes:
+                    values = array.array(RUN_TYPE, self.store_map[start:start + count * RUN_ITEM_SIZE])
+                    values.byteswap()
+                else:
+                    values = memoryview(self.store_map)[start:start + count * RUN_ITEM_SIZE].cast(RUN_TYPE)
+                    self.run_views.append(values)
+                runs.append(values)
+            runs = self.runs[(record["name"], kind)] = tuple(runs)
+        return runs
+
+    def unknown_bases(self, record):
+        """Returns the number of positions in the record that aren't one of the 4 nucleotides"""
+        starts, ends = self.get_runs(record, "n_runs")
+        return sum(ends) - sum(starts)
+
+    def total_length(self):
+        return sum(record["length"] for record in self.records)
+
+    def get_record(self, record_name):
+        record = self.record_index.get(record_name)
+        if record is None:
+            raise ValueError(f"{self.filename} has no record called {record_name}")
+        return record
+
+    def get_sequence(self, record_name, start=0, end=None):
+        """Returns the nucleotides from start up to but not including end, counting from 0. Only the bytes holding
+        them are read from the file"""
+        record = self.get_record(record_name)
+        end = record["length"] if end is None else min(end, record["length"])
+        start = max(start, 0)
+        if start >= end:
+            return ""
+        first_byte = record["offset"] + start // 4
+        last_byte = record["offset"] + (end + 3) // 4
+        RunStats.stats.add("bytes_read", last_byte - first_byte)
+        bases = self.store_map[first_byte:last_byte].hex().translate(HEX_TO_BASES)
+        bases = bases[start % 4:start % 4 + end - start]
+
+        # Put back the runs of other characters, then the lower case of any soft masked bases
+        bases = overlay_runs(bases, start, end, self.get_runs(record, "n_runs"),
+                             lambda piece: UNKNOWN_BASE * len(piece))
+        return overlay_runs(bases, start, end, self.get_runs(record, "mask_runs"), str.lower)
+
+    def stream_windows(self, overlap, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, region=None):
+        """Same as FileHandler.stream_seq_windows() but decodes each window from the store. If a region is given
+        as (record, start, end) only that part of the record is read, and the positions are still those in the
+        whole record"""
+        if region is not None:
+            record_name, start, end = region
+            record = self.get_record(record_name)
+            spans = [(record, start, record["length"] if end is None else min(end, record["length"]))]
+        else:
+            spans = [(record, 0, record["length"]) for record in self.records]
+        for record, start, end in spans:
+            RunStats.stats.add("records_read")
+            for chunk_start in range(start, end, chunk_size):
+                window_start = max(chunk_start - overlap, start)
+                window = self.get_sequence(record["name"], window_start, min(chunk_start + chunk_size, end))
+                yield record["name"], window_start, window, chunk_start - window_start
+
+
+def parse_command_line():
+    files = {}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition("=")
+        if name in ("fasta_file", "store_file") and value:
+            files[name] = value
+        else:
+            print(f"Unrecognised argument: {arg}")
+    if len(files) != 2:
+        print("\ncommand line usage:  SeqStore fasta_file=filename store_file=filename\n")
+        print("Converts the FASTA file to a packed store which can then be used as the seq_file of Regulon, with")
+        print("-region=record:start-end to search just part of one record\n")
+        return None
+    return files
+
+
+if __name__ == "__main__":
+    command_files = parse_command_line()
+    if command_files:
+        record_count = convert_fasta(command_files["fasta_file"], command_files["store_file"])
+        print(f"Wrote {record_count} records to {command_files['store_file']}")
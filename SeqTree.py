@@ -14,10 +14,13 @@
 
 # Import standard modules
 import sys
-import time
 import pprint
+from collections import deque
 # import utility module to handle reading the source files
 import FileHandler
+import Nucleotides
+import SeqScanner
+import RunStats
 
 
 class Node(object):
@@ -30,14 +33,18 @@ class Node(object):
         self.G = None
         self.T = None
         self.nucleotide = base
-        self.RE_list = []  # supports several RE names for the same sequence
+        self.RE_list = []  # supports several (RE name, strand) entries for the same sequence
         self.is_branch_end = None
+        self.depth = 0          # number of nucleotides from the root to this node
+        # Only used by the Aho-Corasick automaton mode, see RESeqTree.build_automaton()
+        self.fail = None        # node for the longest proper suffix of this branch that is also in the tree
+        self.output = None      # nearest node along the failure links that is a branch end
 
 
 class RESeqTree:
     """This is the class that represents the restriction enzyme (RE) sequence tree which is made up of the Node class"""
 
-    def __init__(self):
+    def __init__(self, use_automaton=False, both_strands=False, max_mismatches=0):
         self.root = Node()
         self.tree_width = 0
         self.tree_depth = 0
@@ -61,6 +68,27 @@ class RESeqTree:
         # something that manages the matches for this combination and run
         # self.matches = dict()
 
+        # When set the tree is turned into an Aho-Corasick automaton once it has been built so the DNA sequence can
+        # be scanned in a single pass, rather than restarting at the root for every position
+        self.use_automaton = use_automaton
+        self.automaton_built = False
+
+        # When set the reverse complement of each enzyme is inserted as well so one scan finds both strands
+        self.both_strands = both_strands
+        # When more than 0 the search also reports near-sites that differ from a sequence in up to this many positions
+        self.max_mismatches = max_mismatches
+
+        # Where the matches from the current call to scan_sequence() are reported, along with the FASTA record,
+        # the position of the chunk being scanned in that record and how much of it overlaps the previous chunk
+        self.result_manager = None
+        self.scan_record = None
+        self.scan_offset = 0
+        self.scan_overlap = 0
+
+        # Counters added to the run statistics, see RunStats.py
+        self.node_count = 1
+        self.nodes_visited = 0
+
     def get_root(self):
         return self.root
 
@@ -79,193 +107,332 @@ class RESeqTree:
         # Using a hashcode to check the content of the file is a much better way to ensure that the file
         # contents have not been changed even if the name stays the same
 
+        checksum = FileHandler.file_checksum(filename)
+        if filename == self.re_filename and checksum == self.re_file_MD5_checksum:
+            return self.get_root()
         if filename == self.re_filename:
+            # The file has been edited since the tree was built, so only apply the changes
+            self.reload_enzymes(filename)
             return self.get_root()
 
         # It's a new file so we need a new tree, set the name so the check above will catch the reuse of the file
         self.re_filename = filename
+        self.re_file_MD5_checksum = checksum
 
         # Call the function to load the sequences from the restriction enzyme definition file
-        self.re_seq_dict, self.tree_depth = FileHandler.import_restriction_enzymes(filename)
+        with RunStats.stats.timer("parse_enzymes"):
+            self.re_seq_dict, self.tree_depth = FileHandler.import_restriction_enzymes(filename)
+        self.sequence_count = len(self.re_seq_dict)
 
         # Calculate the progress of the tree build and display this to the user
-        current_seq_count = 1
-        sequences_to_build = len(self.re_seq_dict)
-        for re_name, seq in self.re_seq_dict.items():
-            pct_complete = (current_seq_count / sequences_to_build) * 100
-            sys.stdout.write(f"\rProcessing Restriction Enzymes sequences from {filename}: %d%% completed"
-                             % pct_complete)  # Prints on the same line
-            self.insert_sequence(self.root, seq, re_name)
-            current_seq_count += 1
-            time.sleep(0.02)
-        print()
+        start_node_count = self.node_count
+        sequences = Nucleotides.strand_sequences(self.re_seq_dict, self.both_strands)
+        progress = RunStats.Progress(f"Processing Restriction Enzymes sequences from {filename}", len(sequences))
+        with RunStats.stats.timer("insert_sequences"):
+            for current_seq_count, (entry, seq) in enumerate(sequences, 1):
+                self.insert_sequence(self.root, seq, entry)
+                progress.update(current_seq_count)
+        progress.finish()
+        RunStats.stats.add("nodes_created", self.node_count - start_node_count)
+        if self.use_automaton:
+            with RunStats.stats.timer("build_automaton"):
+                self.build_automaton()
         # print(re_seq_dict)  # DEBUG
 
-    def insert_sequence(self, node, sequence, name):
-        if len(sequence) <= 0:
-            node.RE_list.append(name)
-            node.is_branch_end = True
+    def insert_sequence(self, node, sequence, entry):
+        """Adds the (name, strand) entry to the end of every branch the sequence expands into. Works along the
+        sequence one position at a time keeping the nodes reached so far, and looks up the bases each IUPAC ambiguity
+        code stands for in Nucleotides.IUPAC_CODES"""
+        # Support for DNA ambiguity codes from https://www.dnabaser.com/articles/IUPAC%20ambiguity%20codes.html
+        frontier = [node]
+        for current_base in sequence:
+            bases = Nucleotides.IUPAC_CODES.get(current_base)
+            if bases is None:
+                print("Nucleotide", current_base, "not supported in SeqTree.insert_sequence()")
+                return
+            next_frontier = []
+            for parent in frontier:
+                for base in bases:
+                    child = getattr(parent, base)
+                    if child is None:
+                        child = Node(base)
+                        child.depth = parent.depth + 1
+                        setattr(parent, base, child)
+                        self.node_count += 1
+                    next_frontier.append(child)
+            frontier = next_frontier
+        for branch_end in frontier:
+            branch_end.RE_list.append(entry)
+            branch_end.is_branch_end = True
             self.unique_sequence_count += 1
             self.tree_width += 1
-            return
-        current_base = sequence[0]
-        new_sequence = sequence[1:]
-        # These are the 4 basic nucleotides
-        if current_base == "A":
-            self.insert_A(current_base, name, new_sequence, node)
-        elif current_base == "C":
-            self.insert_C(current_base, name, new_sequence, node)
-        elif current_base == "G":
-            self.insert_G(current_base, name, new_sequence, node)
-        elif current_base == "T":
-            self.insert_T(current_base, name, new_sequence, node)
 
-        # Support for DNA ambiguity codes from https://www.dnabaser.com/articles/IUPAC%20ambiguity%20codes.html
-        # The following are combinations of 2 nucleotides
-        elif current_base == "Y":  # Pyrimidine (C or T)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        elif current_base == "R":  # Purine (A or G)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-        elif current_base == "W":  # Weak (A or T)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        elif current_base == "S":  # Strong (G or C)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-        elif current_base == "K":  # Keto (T or G)
-            self.insert_G("G", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        elif current_base == "M":  # Amino (A or C)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_C("C", name, new_sequence, node)
-
-        # The following are combinations of 3 nucleotides
-        elif current_base == "D":  # A, G and T (not C)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        elif current_base == "V":  # A, C and G (not T)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-        elif current_base == "H":  # A, C and T (not G)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        elif current_base == "B":  # C, G and T (not A)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-
-        # The following is all 4 nucleotides
-        elif current_base == "N" or current_base == "X":  # All nucleotides (A, C, G and T)
-            self.insert_A("A", name, new_sequence, node)
-            self.insert_C("C", name, new_sequence, node)
-            self.insert_G("G", name, new_sequence, node)
-            self.insert_T("T", name, new_sequence, node)
-        else:
-            print("Nucleotide", current_base, "not supported in SeqTree.insert_sequence()")
-
-    def insert_A(self, current_base, name, new_sequence, node):
-        if node.A is None:
-            new_node = Node(current_base)
-            node.A = new_node
-            self.insert_sequence(new_node, new_sequence, name)
-        else:
-            self.insert_sequence(node.A, new_sequence, name)
-
-    def insert_C(self, current_base, name, new_sequence, node):
-        if node.C is None:
-            new_node = Node(current_base)
-            node.C = new_node
-            self.insert_sequence(new_node, new_sequence, name)
-        else:
-            self.insert_sequence(node.C, new_sequence, name)
-
-    def insert_G(self, current_base, name, new_sequence, node):
-        if node.G is None:
-            new_node = Node(current_base)
-            node.G = new_node
-            self.insert_sequence(new_node, new_sequence, name)
-        else:
-            self.insert_sequence(node.G, new_sequence, name)
-
-    def insert_T(self, current_base, name, new_sequence, node):
-        if node.T is None:
-            new_node = Node(current_base)
-            node.T = new_node
-            self.insert_sequence(new_node, new_sequence, name)
-        else:
-            self.insert_sequence(node.T, new_sequence, name)
+    def add_enzyme(self, re_name, seq):
+        """Inserts one restriction enzyme into the tree that has already been built, replacing it if the name is
+        already in the tree"""
+        if re_name in self.re_seq_dict:
+            self.remove_enzyme(re_name)
+        start_node_count = self.node_count
+        self.re_seq_dict[re_name] = seq
+        self.sequence_count += 1
+        for entry, strand_seq in Nucleotides.strand_sequences({re_name: seq}, self.both_strands):
+            self.add_sequence(entry, strand_seq)
+        RunStats.stats.add("nodes_created", self.node_count - start_node_count)
+
+    def add_sequence(self, entry, seq):
+        """Inserts the sequence of one strand of an enzyme, given as a (name, strand) entry, into the tree that has
+        already been built"""
+        self.insert_sequence(self.root, seq, entry)
+        self.tree_depth = max(self.tree_depth, len(seq))
+        # The failure links have to be worked out again for the new branches
+        self.automaton_built = False
+
+    def remove_enzyme(self, re_name):
+        """Takes one restriction enzyme out of the tree, along with any branches that no other enzyme uses.
+        Returns False if the enzyme isn't in the tree"""
+        seq = self.re_seq_dict.pop(re_name, None)
+        if seq is None:
+            return False
+        self.sequence_count -= 1
+        for entry, strand_seq in Nucleotides.strand_sequences({re_name: seq}, self.both_strands):
+            self.remove_sequence(self.root, strand_seq, entry)
+        self.tree_depth = max((len(seq) for seq in self.re_seq_dict.values()), default=0)
+        self.automaton_built = False
+        return True
+
+    def remove_sequence(self, node, sequence, entry):
+        """Follows every branch the sequence expands into and removes the (name, strand) entry from the branch ends.
+        Works along the sequence one position at a time like insert_sequence(), keeping the links followed at each
+        level, then goes back up them from the deepest cutting off any child left with no names and no children of its
+        own. Returns True if the node itself is no longer needed"""
+        frontier = [node]
+        levels = []
+        for current_base in sequence:
+            links = []
+            next_frontier = []
+            for parent in frontier:
+                for base in Nucleotides.IUPAC_CODES.get(current_base, ""):
+                    child = getattr(parent, base)
+                    if child is not None:
+                        links.append((parent, base, child))
+                        next_frontier.append(child)
+            levels.append(links)
+            frontier = next_frontier
+        for branch_end in frontier:
+            if entry in branch_end.RE_list:
+                branch_end.RE_list.remove(entry)
+                self.unique_sequence_count -= 1
+                self.tree_width -= 1
+            if not branch_end.RE_list:
+                branch_end.is_branch_end = None
+        for links in reversed(levels):
+            for parent, base, child in links:
+                if not child.RE_list and not (child.A or child.C or child.G or child.T):
+                    setattr(parent, base, None)
+                    self.node_count -= 1
+        return not node.RE_list and not (node.A or node.C or node.G or node.T)
+
+    def reload_enzymes(self, filename):
+        """Brings the tree up to date with the restriction enzyme definition file by only removing the enzymes that
+        have gone or changed and adding the ones that are new or changed, rather than building the whole tree again.
+        Returns the number of enzymes removed and added"""
+        with RunStats.stats.timer("parse_enzymes"):
+            new_re_seq_dict, tree_depth = FileHandler.import_restriction_enzymes(filename)
+        removed = [re_name for re_name, seq in self.re_seq_dict.items() if new_re_seq_dict.get(re_name) != seq]
+        added = [re_name for re_name, seq in new_re_seq_dict.items() if self.re_seq_dict.get(re_name) != seq]
+        with RunStats.stats.timer("insert_sequences"):
+            for re_name in removed:
+                self.remove_enzyme(re_name)
+            for re_name in added:
+                self.add_enzyme(re_name, new_re_seq_dict[re_name])
+        # Keep the order of the file so the results list the enzymes in the same order as a new tree would
+        self.re_seq_dict = new_re_seq_dict
+        self.tree_depth = tree_depth
+        self.sequence_count = len(self.re_seq_dict)
+        self.re_filename = filename
+        self.re_file_MD5_checksum = FileHandler.file_checksum(filename)
+        if self.use_automaton and not self.automaton_built:
+            with RunStats.stats.timer("build_automaton"):
+                self.build_automaton()
+        print(f"Reloaded {filename}, removed {len(removed)} and added {len(added)} restriction enzymes")
+        return len(removed), len(added)
+
+    def build_automaton(self):
+        """Adds Aho-Corasick failure and output links to the nodes of the tree. Works breadth first from the root so
+        the failure link of every parent is known before its children are visited"""
+        root = self.get_root()
+        root.fail = root
+        root.output = None
+        queue = deque()
+        for child in (root.A, root.C, root.G, root.T):
+            if child:
+                child.fail = root
+                child.output = None
+                queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for base in "ACGT":
+                child = getattr(node, base)
+                if child is None:
+                    continue
+                # Follow the failure links of the parent until we find a node that can be extended with this base
+                fail_node = node.fail
+                while fail_node is not root and getattr(fail_node, base) is None:
+                    fail_node = fail_node.fail
+                next_node = getattr(fail_node, base)
+                child.fail = next_node if next_node is not None else root
+                # The output link skips over failure nodes that aren't the end of a reference sequence
+                if child.fail.is_branch_end:
+                    child.output = child.fail
+                else:
+                    child.output = child.fail.output
+                queue.append(child)
+        self.automaton_built = True
+
+    def scan_automaton(self, dna_sequence):
+        """Single pass search of the DNA sequence using the failure links, each base is read once and every
+        reference sequence ending at that base is reported, including nested and overlapping sites"""
+        if not self.automaton_built:
+            self.build_automaton()
+        root = self.get_root()
+        node = root
+        nodes_visited = 0
+        for pos, base in enumerate(dna_sequence):
+            if base not in "ACGT":
+                # Anything other than the 4 basic nucleotides can't be part of a match so start again from the root
+                node = root
+                continue
+            while node is not root and getattr(node, base) is None:
+                node = node.fail
+                nodes_visited += 1
+            node = getattr(node, base) or root
+            nodes_visited += 1
+
+            match_node = node if node.is_branch_end else node.output
+            while match_node:
+                # Convert the end of the match back to its start
+                self.report_match(pos - match_node.depth + 1, match_node)
+                match_node = match_node.output
+        self.nodes_visited += nodes_visited
+
+    def find_matches(self, filename, result_manager, chunk_size=FileHandler.DEFAULT_CHUNK_SIZE, region=None):
+        SeqScanner.scan_file(self, filename, result_manager, chunk_size, region=region)
+
+    def scan_sequence(self, dna_sequence, result_manager, record=None, offset=0, overlap=0):
+        """Searches one chunk of a DNA sequence. The offset is the position of the chunk in its FASTA record and
+        the first overlap nucleotides were already searched as the end of the previous chunk"""
+        self.result_manager = result_manager
+        self.scan_record = record
+        self.scan_offset = offset
+        self.scan_overlap = overlap
+        self.nodes_visited = 0
+        if self.max_mismatches:
+            self.scan_mismatches(dna_sequence)
+            RunStats.stats.add("nodes_visited", self.nodes_visited)
+            return
+        if self.use_automaton:
+            self.scan_automaton(dna_sequence)
+            RunStats.stats.add("nodes_visited", self.nodes_visited)
+            return
 
-    def find_matches(self, filename, result_manager):
-        dna_sequence = FileHandler.import_seq_file(filename)
         dna_seq_length = len(dna_sequence)
-        print(f"DNA sequence is {dna_seq_length} nucleotides long")
         ref_seq_length = self.get_tree_depth()
-        print(f"Longest reference sequence is {ref_seq_length} nucleotides long")
-        node = self.get_root()
-
-        # To optimise search limit the number of nucleotides beyond the current sequence read to the length of the
-        # longest reference sequence in the tree i.e tree_depth but the shortest sequence ever likely to be used is
-        # 4 nucleotides long so stop 4 short of the end of the sequence to avoid an IndexError: out of bounds error
-        for pos in range(dna_seq_length - 4):
-            if pos + ref_seq_length > dna_seq_length:
-                search_window_end = dna_seq_length
-            else:
-                search_window_end = pos + ref_seq_length
-            dna_sub_sequence = dna_sequence[pos:search_window_end]
-            if dna_sub_sequence[0] == "A" and node.A:
-                self.search_branch(node.A, dna_sub_sequence, pos)
-            if dna_sub_sequence[0] == "C" and node.C:
-                self.search_branch(node.C, dna_sub_sequence, pos)
-            if dna_sub_sequence[0] == "G" and node.G:
-                self.search_branch(node.G, dna_sub_sequence, pos)
-            if dna_sub_sequence[0] == "T" and node.T:
-                self.search_branch(node.T, dna_sub_sequence, pos)
-
-    def search_branch(self, node, dna_sub_sequence, position):
-        if node is None:
-            print("No valid tree node provided to SeqTree.search_branch()")
-            return
-        if node.is_branch_end:
-            # TODO: make it work with ResultManager
-            # Add the current
-            #if position in self.matches:
-            #    print("Duplicate position match at ", position)
-            #    print("Dictionary contains", self.matches[position])
-            #    print("trying to add", node.RE_list)
-            #    # get the existing list for this key
-            #    re_list = self.matches[position]
-            #    # Use extend to combine the 2 lists but keep them flat. Append would nest one list inside the other.
-            #    re_list.extend(node.RE_list)
-            #    # convert to set to remove duplicates the back to list
-            #    re_list = list(set(re_list))
-            #    # overwrite existing entry with new list
-            #    self.matches[position] = re_list
-            #    print("Dict now reads ->", self.matches[position])
-            #else:
-            # Add the names of the reference sequences and the original position to the results manager dictionary
-            # self.matches[position] = node.RE_list
-
-            # need to add 1 to position because loop starts from 0
-            print(f"found match at {position + 1} for {node.RE_list}")
-            return
-        dna_sub_sequence = dna_sub_sequence[1:]
-        if dna_sub_sequence[0] == "A" and node.A:
-            self.search_branch(node.A, dna_sub_sequence, position)
-            return
-        if dna_sub_sequence[0] == "C" and node.C:
-            self.search_branch(node.C, dna_sub_sequence, position)
-            return
-        if dna_sub_sequence[0] == "G" and node.G:
-            self.search_branch(node.G, dna_sub_sequence, position)
-            return
-        if dna_sub_sequence[0] == "T" and node.T:
-            self.search_branch(node.T, dna_sub_sequence, position)
+        root = self.get_root()
+        bases = Nucleotides.BASES
+        nodes_visited = 0
+
+        # Walk down the tree from each position of the DNA sequence in turn. To optimise search limit the number of
+        # nucleotides beyond the current position to the length of the longest reference sequence i.e tree_depth
+        for pos in range(dna_seq_length):
+            node = root
+            for index in range(pos, min(pos + ref_seq_length, dna_seq_length)):
+                base = dna_sequence[index]
+                if base not in bases:
+                    break
+                node = getattr(node, base)
+                if node is None:
+                    break
+                nodes_visited += 1
+                if node.is_branch_end:
+                    self.report_match(pos, node)
+                    break
+        self.nodes_visited = nodes_visited
+        RunStats.stats.add("nodes_visited", self.nodes_visited)
+
+    def scan_mismatches(self, dna_sequence):
+        """Walks down the tree from each position of the DNA sequence following every branch, not just the one for
+        the next base, while the number of bases that differ is within max_mismatches. Branches over the budget are
+        dropped straight away so only a small part of the tree is visited. Anything other than the 4 basic
+        nucleotides is never allowed as a mismatch, so a match can't run across a gap in the sequence"""
+        dna_seq_length = len(dna_sequence)
+        ref_seq_length = self.get_tree_depth()
+        max_mismatches = self.max_mismatches
+        root = self.get_root()
+        bases = Nucleotides.BASES
+        nodes_visited = 0
+        for pos in range(dna_seq_length):
+            search_window_end = min(pos + ref_seq_length, dna_seq_length)
+            # An ambiguity code expands into several branches so the same enzyme can be reached more than once,
+            # only the fewest mismatches is kept for each entry
+            found = {}
+            stack = [(root, pos, 0)]
+            while stack:
+                node, index, mismatches = stack.pop()
+                base = dna_sequence[index]
+                if base not in bases:
+                    continue
+                for child_base in bases:
+                    child = getattr(node, child_base)
+                    if child is None:
+                        continue
+                    child_mismatches = mismatches if child_base == base else mismatches + 1
+                    if child_mismatches > max_mismatches:
+                        continue
+                    nodes_visited += 1
+                    if child.is_branch_end:
+                        for entry in child.RE_list:
+                            if entry not in found or found[entry][0] > child_mismatches:
+                                found[entry] = (child_mismatches, child.depth)
+                    # Carry on below a branch end, a longer sequence can start with a shorter one
+                    if index + 1 < search_window_end:
+                        stack.append((child, index + 1, child_mismatches))
+            if found:
+                entries_by_site = {}
+                for entry, site in found.items():
+                    entries_by_site.setdefault(site, []).append(entry)
+                for (mismatches, depth), entries in sorted(entries_by_site.items()):
+                    self.report_names(pos, depth, entries, mismatches)
+        self.nodes_visited += nodes_visited
+
+    def report_match(self, position, node):
+        self.report_names(position, node.depth, node.RE_list)
+
+    def report_names(self, position, depth, entries, mismatches=0):
+        """Passes the (name, strand) entries at a branch end to the results manager. Matches that end inside the
+        overlap with the previous chunk were already reported when that chunk was searched so they are skipped"""
+        if position + depth <= self.scan_overlap:
             return
+        # need to add 1 to position because loop starts from 0
+        Nucleotides.report_strands(self.result_manager, self.scan_offset + position + 1, entries, self.scan_record,
+                                   mismatches)
+
+    def memory_usage(self):
+        """Returns the number of nodes in the tree and an estimate of the bytes used by the node objects, their
+        attribute dictionaries and their RE lists"""
+        node_count = 0
+        total_bytes = 0
+        stack = [self.get_root()]
+        while stack:
+            node = stack.pop()
+            node_count += 1
+            total_bytes += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.RE_list)
+            stack.extend(child for child in (node.A, node.C, node.G, node.T) if child)
+        return {"nodes": node_count, "bytes": total_bytes}
+
+    def print_memory_usage(self):
+        usage = self.memory_usage()
+        print(f"Tree has {usage['nodes']} nodes using approximately {usage['bytes']} bytes")
 
     def print_branch(self, node):
         if node is None:
@@ -276,7 +443,8 @@ class RESeqTree:
         if node.nucleotide:
             self.branch_sequence = self.branch_sequence + node.nucleotide
         if node.is_branch_end:
-            temp = self.branch_sequence + " -> " + ', '.join(node.RE_list)  # replaces [] from std List print with ","
+            # replaces [] from std List print with ","
+            temp = self.branch_sequence + " -> " + ', '.join(Nucleotides.strand_label(entry) for entry in node.RE_list)
             self.tree_sequences.append(temp)
         if node.A:
             self.print_branch(node.A)
@@ -0,0 +1,143 @@
+#############################################################################
+#
+#   Usage:      Used by CompactSeqTree.py, turned off with -nocache
+#
+#   This File:  Keeps compiled compact trees on disk so the same
+#               restriction enzyme file doesn't have to be expanded into a
+#               tree again on every run. Files are named after the MD5 of
+#               the enzyme file and the tree version, and are memory mapped
+#               when loaded
+#
+#############################################################################
+
+# Import standard modules
+import os
+import sys
+import mmap
+import json
+import struct
+
+# Identifies a cache file and the layout of its header
+CACHE_MAGIC = b"RGLN"
+CACHE_FORMAT_VERSION = 1
+# magic, format version, tree version, byte order, number of ints in each of the 3 arrays, bytes of json metadata.
+# This comes to 48 bytes so the arrays that follow start on an 8 byte boundary
+HEADER_FORMAT = "<4sIIIQQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BYTE_ORDER = {"little": 1, "big": 2}
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".regulon_cache")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_EXTENSION = ".rtree"
+
+
+class Tree_Cache():
+    """Directory of compiled trees. Whenever a tree is saved the least recently used files are removed until the
+    directory is no bigger than max_bytes"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def cache_path(self, checksum, tree_version):
+        return os.path.join(self.cache_dir, f"{checksum}-v{tree_version}{CACHE_EXTENSION}")
+
+    def load_tree(self, tree, checksum):
+        """Fills in the arrays and metadata of the compact tree from the cache. Returns False if there is no usable
+        cache file, in which case the tree is left untouched and has to be built from the enzyme file"""
+        if not checksum:
+            return False
+        path = self.cache_path(checksum, tree.TREE_VERSION)
+        if not os.path.exists(path):
+            return False
+        cache_map = None
+        try:
+            with open(path, "rb") as cache_file:
+                cache_map = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = struct.unpack_from(HEADER_FORMAT, cache_map, 0)
+            magic, format_version, tree_version, byte_order, children_len, offsets_len, values_len, meta_len = header
+            data_len = (children_len + offsets_len + values_len) * 4
+            if (magic != CACHE_MAGIC or format_version != CACHE_FORMAT_VERSION or tree_version != tree.TREE_VERSION
+                    or byte_order != BYTE_ORDER[sys.byteorder] or len(cache_map) != HEADER_SIZE + data_len + meta_len):
+                # Written by a different version, on a different machine or only partly written, so start again
+                cache_map.close()
+                self.remove_file(path)
+                return False
+
+            # The arrays are used straight from the mapped file so only the pages that are touched get read
+            view = memoryview(cache_map)
+            start = HEADER_SIZE
+            children = view[start:start + children_len * 4].cast("i")
+            start += children_len * 4
+            re_offsets = view[start:start + offsets_len * 4].cast("i")
+            start += offsets_len * 4
+            re_values = view[start:start + values_len * 4].cast("i")
+            start += values_len * 4
+            metadata = json.loads(bytes(view[start:start + meta_len]).decode("utf-8"))
+        except Exception as err:
+            print(f"\nERROR - TreeCache.load_tree() had a problem with the file: {path}.\nError was: ", err)
+            if cache_map is not None:
+                # The views of the arrays hold the map open, so they have to go first
+                view = children = re_offsets = re_values = None
+                cache_map.close()
+            self.remove_file(path)
+            return False
+
+        tree.load_arrays(children, re_offsets, re_values, metadata, cache_map)
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def save_tree(self, tree, checksum):
+        if not checksum:
+            return
+        path = self.cache_path(checksum, tree.TREE_VERSION)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        metadata = json.dumps(tree.get_metadata()).encode("utf-8")
+        header = struct.pack(HEADER_FORMAT, CACHE_MAGIC, CACHE_FORMAT_VERSION, tree.TREE_VERSION,
+                             BYTE_ORDER[sys.byteorder], len(tree.children), len(tree.re_offsets),
+                             len(tree.re_values), len(metadata))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file and rename it so another process never sees a half written cache file
+            with open(temp_path, "wb") as cache_file:
+                cache_file.write(header)
+                cache_file.write(tree.children.tobytes())
+                cache_file.write(tree.re_offsets.tobytes())
+                cache_file.write(tree.re_values.tobytes())
+                cache_file.write(metadata)
+            os.replace(temp_path, path)
+        except Exception as err:
+            print(f"\nERROR - TreeCache.save_tree() had a problem with the file: {path}.\nError was: ", err)
+            self.remove_file(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used cache files until the total size is within max_bytes"""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(CACHE_EXTENSION):
+                    path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+        total_bytes = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if self.remove_file(path):
+                total_bytes -= size
+
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process, or still mapped by one on Windows
+            return False
+        return True